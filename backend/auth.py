@@ -6,36 +6,11 @@ from google.oauth2.credentials import Credentials
 from starlette.config import Config
 from starlette.requests import Request
 from starlette.middleware.sessions import SessionMiddleware
-from dotenv import load_dotenv
-
-load_dotenv()
+from backend import config
+from backend import sessions, warmup
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-# Allow non-HTTPS for local dev
-os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
-os.environ["OAUTHLIB_RELAX_TOKEN_SCOPE"] = "1"
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CLIENT_SECRETS_FILE = os.getenv("CLIENT_SECRETS_FILE", os.path.join(BASE_DIR, "client_secret.json"))
-
-# Fallback: Check root directory if not found in backend or if explicitly set path missing
-print(f"--- AUTH DEBUG ---")
-print(f"Attempting to find client_secret.json...")
-print(f"Primary path check: {CLIENT_SECRETS_FILE}")
-
-if not os.path.exists(CLIENT_SECRETS_FILE):
-    print(f"Primary path not found. Checking parent directory fallback...")
-    root_secret = os.path.join(os.path.dirname(BASE_DIR), "client_secret.json")
-    print(f"Secondary path check: {root_secret}")
-    if os.path.exists(root_secret):
-        CLIENT_SECRETS_FILE = root_secret
-        print(f"Found secret at: {CLIENT_SECRETS_FILE}")
-    else:
-        print(f"CRITICAL: client_secret.json not found at {CLIENT_SECRETS_FILE} or {root_secret}")
-else:
-    print(f"Using secret at: {CLIENT_SECRETS_FILE}")
-print(f"------------------")
 SCOPES = [
     'https://www.googleapis.com/auth/classroom.courses.readonly',
     'https://www.googleapis.com/auth/classroom.courseworkmaterials.readonly',
@@ -54,12 +29,23 @@ def get_flow(redirect_uri: str = None):
         backend_url = os.getenv("BACKEND_URL", "http://localhost:8000").rstrip("/")
         redirect_uri = f"{backend_url}/auth/callback"
     
-    return Flow.from_client_secrets_file(
-        CLIENT_SECRETS_FILE,
+    return Flow.from_client_config(
+        config.load_config(),
         scopes=SCOPES,
         redirect_uri=redirect_uri
     )
 
+def get_user_id_from_token(id_token):
+    """'sub' claim of the ID token we just received from Google's token endpoint"""
+    if not id_token:
+        return None
+    from google.auth import jwt
+    try:
+        return jwt.decode(id_token, verify=False).get("sub")
+    except Exception as e:
+        print(f"DEBUG: Could not read ID token: {e}")
+        return None
+
 @router.get("/login")
 def login(request: Request):
     flow = get_flow()
@@ -82,14 +68,20 @@ def callback(request: Request, code: str, state: str):
     
     credentials = flow.credentials
     
-    # Optimize session size: Only store tokens. 
+    # Tokens stay server-side; the cookie only carries an opaque session id.
     # Client ID/Secret are in our local file anyway.
-    request.session["credentials"] = {
-        "token": credentials.token,
-        "refresh_token": credentials.refresh_token,
-        "token_uri": credentials.token_uri,
-        "scopes": credentials.scopes
-    }
+    old_sid = request.session.get("sid")
+    if old_sid:
+        sessions.delete_session(old_sid)
+        warmup.invalidate(old_sid)
+    sid = sessions.new_session_id()
+    sessions.save_credentials(sid, credentials, get_user_id_from_token(credentials.id_token))
+    request.session.pop("state", None)
+    # Set by older versions of the login
+    request.session.pop("user_id", None)
+    request.session["sid"] = sid
+    # Optional: prefetch courses and recent materials while the dashboard loads
+    warmup.start_warm_up(sid, sessions.load_credentials(sid, get_client_info()))
     print(f"DEBUG: Session initialized in callback for user")
     
     # Redirect to frontend dashboard (hardcoded for now, should be env var)
@@ -98,35 +90,36 @@ def callback(request: Request, code: str, state: str):
 
 @router.get("/logout")
 def logout(request: Request):
+    sid = request.session.get("sid")
+    if sid:
+        sessions.delete_session(sid)
+        warmup.invalidate(sid)
     request.session.clear()
     return {"message": "Logged out"}
 
 @router.get("/me")
 def get_current_user(request: Request):
-    creds_data = request.session.get("credentials")
-    if not creds_data:
+    sid = request.session.get("sid")
+    if not sid or sessions.token_store.get(sid) is None:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     # You could fetch user info here using the credentials
     # For now, just return valid status
     return {"authenticated": True}
 
+def get_client_info():
+    """client_id/client_secret, loaded once at startup by config.load_config()"""
+    return config.load_config()["web"]
+
 def get_credentials(request: Request) -> Credentials:
-    creds_data = request.session.get("credentials")
-    if not creds_data:
-        print(f"DEBUG: No credentials in session. Session ID maybe missing or expired.")
+    sid = request.session.get("sid")
+    creds = sessions.load_credentials(sid, get_client_info()) if sid else None
+    if creds is None:
+        print(f"DEBUG: No credentials for session. Session ID maybe missing or expired.")
         raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    # Load client info from local file to keep session small
-    import json
-    with open(CLIENT_SECRETS_FILE, 'r') as f:
-        client_info = json.load(f)["web"]
+    return creds
 
-    return Credentials(
-        token=creds_data["token"],
-        refresh_token=creds_data.get("refresh_token"),
-        token_uri=creds_data["token_uri"],
-        client_id=client_info["client_id"],
-        client_secret=client_info["client_secret"],
-        scopes=creds_data["scopes"]
-    )
+def get_user_id(request: Request):
+    """Google account id of the session, from the server-side session record"""
+    sid = request.session.get("sid")
+    return sessions.get_user_id(sid) if sid else None
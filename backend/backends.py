@@ -0,0 +1,419 @@
+import os
+import json
+import time
+import heapq
+import itertools
+import sqlite3
+import tempfile
+import threading
+
+# Pluggable job state, job queue and artifact storage, so that API nodes can be
+# stateless and separate worker processes (backend/worker.py) can run the jobs.
+#   JOB_STORE       sqlite (default) | memory | redis
+#   JOB_QUEUE       local (default, run in a thread of this process) | sqlite | redis
+#   ARTIFACT_STORE  local (default) | s3
+JOB_STORE = os.getenv("JOB_STORE", "sqlite")
+JOB_QUEUE = os.getenv("JOB_QUEUE", "local")
+ARTIFACT_STORE = os.getenv("ARTIFACT_STORE", "local")
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "gcr_jobs.db"))
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", tempfile.gettempdir())
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(24 * 3600)))
+# A claimed job goes back to the queue if its worker stops renewing the lease
+QUEUE_LEASE_SECONDS = int(os.getenv("QUEUE_LEASE_SECONDS", "300"))
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # e.g. a local MinIO
+S3_PREFIX = os.getenv("S3_PREFIX", "gcr/")
+S3_URL_EXPIRY = int(os.getenv("S3_URL_EXPIRY", "3600"))
+
+
+def _redis_client():
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("JOB_STORE/JOB_QUEUE=redis needs the 'redis' package (pip install redis)")
+    return redis.Redis.from_url(REDIS_URL)
+
+
+def _sqlite(path):
+    # Queued payloads carry OAuth tokens: create the file readable by this user only
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+    os.chmod(path, 0o600)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    # Several processes share this file
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+# --- Job state ---
+# Cancel requests (request_cancel / is_cancel_requested) are kept apart from
+# the job record, which the running job overwrites.
+
+class MemoryJobStore:
+    """Job state in this process only (single-process deployments)"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    def create(self, job_id, data):
+        with self._lock:
+            self._jobs[job_id] = dict(data)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            self._cancelled.add(job_id)
+
+    def is_cancel_requested(self, job_id):
+        with self._lock:
+            return job_id in self._cancelled
+
+
+class SQLiteJobStore:
+    """Job state in a SQLite file shared by all processes on the host"""
+
+    def __init__(self, path=JOB_DB_PATH):
+        self._conn = _sqlite(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_cancellations (job_id TEXT PRIMARY KEY, requested_at REAL NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM job_cancellations WHERE requested_at < ?", (time.time() - JOB_TTL_SECONDS,))
+            self._conn.execute("DELETE FROM jobs WHERE updated_at < ?", (time.time() - JOB_TTL_SECONDS,))
+            self._conn.commit()
+
+    def create(self, job_id, data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, data, updated_at) VALUES (?, ?, ?)",
+                (job_id, json.dumps(data), time.time())
+            )
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id, **fields):
+        # A job is only ever written by the one process running it
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            data = json.loads(row[0])
+            data.update(fields)
+            self._conn.execute(
+                "UPDATE jobs SET data = ?, updated_at = ? WHERE job_id = ?",
+                (json.dumps(data), time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO job_cancellations (job_id, requested_at) VALUES (?, ?)", (job_id, time.time())
+            )
+            self._conn.commit()
+
+    def is_cancel_requested(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM job_cancellations WHERE job_id = ?", (job_id,)).fetchone()
+        return row is not None
+
+
+class RedisJobStore:
+    """Job state in Redis, for API nodes and workers on different hosts"""
+
+    def __init__(self):
+        self._redis = _redis_client()
+
+    def _key(self, job_id):
+        return f"gcr:job:{job_id}"
+
+    def create(self, job_id, data):
+        self._redis.set(self._key(job_id), json.dumps(data), ex=JOB_TTL_SECONDS)
+
+    def get(self, job_id):
+        raw = self._redis.get(self._key(job_id))
+        return json.loads(raw) if raw else None
+
+    def update(self, job_id, **fields):
+        job = self.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        self._redis.set(self._key(job_id), json.dumps(job), ex=JOB_TTL_SECONDS)
+
+    def request_cancel(self, job_id):
+        self._redis.set(f"{self._key(job_id)}:cancel", "1", ex=JOB_TTL_SECONDS)
+
+    def is_cancel_requested(self, job_id):
+        return bool(self._redis.exists(f"{self._key(job_id)}:cancel"))
+
+
+def create_job_store(kind=JOB_STORE):
+    if kind == "memory":
+        return MemoryJobStore()
+    if kind == "redis":
+        return RedisJobStore()
+    return SQLiteJobStore()
+
+
+# --- Job queue ---
+# Payloads carry a "priority": lower numbers run first. A claimed job is
+# leased to its worker, which renews the lease with heartbeat(job_id) and
+# removes the job (and the credentials in its payload) with ack(job_id).
+
+class PriorityGate:
+    """A fixed number of job slots, handed out most-urgent-first.
+    Running jobs call yield_to_waiting() between files: if a more urgent job
+    is waiting, they give it their slot and queue up again (cooperative preemption)."""
+
+    def __init__(self, slots):
+        self._slots = slots
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+
+    def acquire(self, priority):
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            while not (self._slots > 0 and self._waiting[0] == ticket):
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._slots -= 1
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._slots += 1
+            self._cond.notify_all()
+
+    def waiting_count(self):
+        with self._cond:
+            return len(self._waiting)
+
+    def yield_to_waiting(self, priority):
+        with self._cond:
+            preempted = bool(self._waiting) and self._waiting[0][0] < priority
+        if preempted:
+            self.release()
+            self.acquire(priority)
+        return preempted
+
+
+class LocalQueue:
+    """Run each job in a thread of the submitting process (no separate workers).
+    The runner limits how many of them actually run at once."""
+
+    def __init__(self, runner):
+        self._runner = runner
+
+    def submit(self, payload):
+        threading.Thread(target=self._runner, args=(payload,)).start()
+
+    def heartbeat(self, job_id):
+        pass
+
+    def ack(self, job_id):
+        pass
+
+
+class SQLiteQueue:
+    """Queue in a SQLite file; workers on the same host claim jobs from it"""
+
+    def __init__(self, path=JOB_DB_PATH):
+        self._conn = _sqlite(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_queue ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, claimed_at REAL, "
+                "priority INTEGER NOT NULL DEFAULT 1, job_id TEXT)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(job_queue)")]
+            if "priority" not in columns:
+                self._conn.execute("ALTER TABLE job_queue ADD COLUMN priority INTEGER NOT NULL DEFAULT 1")
+            if "job_id" not in columns:
+                self._conn.execute("ALTER TABLE job_queue ADD COLUMN job_id TEXT")
+                self._conn.execute("UPDATE job_queue SET job_id = json_extract(payload, '$.job_id')")
+                # Rows claimed before leases existed are never acked: drop them (and their tokens)
+                self._conn.execute("DELETE FROM job_queue WHERE claimed_at IS NOT NULL")
+            self._conn.commit()
+
+    def submit(self, payload):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO job_queue (payload, priority, job_id) VALUES (?, ?, ?)",
+                (json.dumps(payload), payload.get("priority", 1), payload["job_id"])
+            )
+            self._conn.commit()
+
+    def claim(self, timeout=5):
+        """Take the most urgent (then oldest) job that is unclaimed or whose lease
+        expired, waiting up to timeout seconds"""
+        deadline = time.time() + timeout
+        while True:
+            with self._lock:
+                # BEGIN IMMEDIATE takes the write lock, so two workers can't claim the same row
+                self._conn.execute("BEGIN IMMEDIATE")
+                row = self._conn.execute(
+                    "SELECT id, payload FROM job_queue WHERE claimed_at IS NULL OR claimed_at < ? "
+                    "ORDER BY priority, id LIMIT 1",
+                    (time.time() - QUEUE_LEASE_SECONDS,)
+                ).fetchone()
+                if row:
+                    self._conn.execute("UPDATE job_queue SET claimed_at = ? WHERE id = ?", (time.time(), row[0]))
+                self._conn.commit()
+            if row:
+                return json.loads(row[1])
+            if time.time() >= deadline:
+                return None
+            time.sleep(0.5)
+
+    def heartbeat(self, job_id):
+        with self._lock:
+            self._conn.execute("UPDATE job_queue SET claimed_at = ? WHERE job_id = ?", (time.time(), job_id))
+            self._conn.commit()
+
+    def ack(self, job_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM job_queue WHERE job_id = ?", (job_id,))
+            self._conn.commit()
+
+
+class RedisQueue:
+    """Queue as a Redis sorted set scored by (priority, submit time);
+    workers on any host BZPOPMIN from it"""
+
+    KEY = "gcr:job_queue:by_priority"
+    # job_id -> lease expiry, and job_id -> {"payload", "score"} of claimed jobs
+    LEASES = "gcr:job_queue:leases"
+    CLAIMED = "gcr:job_queue:claimed"
+
+    def __init__(self):
+        self._redis = _redis_client()
+
+    def submit(self, payload):
+        score = payload.get("priority", 1) * 1e10 + time.time()
+        self._redis.zadd(self.KEY, {json.dumps(payload): score})
+
+    def _requeue_expired(self):
+        for job_id in self._redis.zrangebyscore(self.LEASES, 0, time.time()):
+            raw = self._redis.hget(self.CLAIMED, job_id)
+            # ZREM succeeds for one worker only, so the job is requeued once
+            if self._redis.zrem(self.LEASES, job_id) and raw:
+                claimed = json.loads(raw)
+                self._redis.zadd(self.KEY, {claimed["payload"]: claimed["score"]})
+                self._redis.hdel(self.CLAIMED, job_id)
+
+    def claim(self, timeout=5):
+        self._requeue_expired()
+        item = self._redis.bzpopmin(self.KEY, timeout=timeout)
+        if not item:
+            return None
+        raw, score = item[1].decode(), item[2]
+        payload = json.loads(raw)
+        pipe = self._redis.pipeline()
+        pipe.hset(self.CLAIMED, payload["job_id"], json.dumps({"payload": raw, "score": score}))
+        pipe.zadd(self.LEASES, {payload["job_id"]: time.time() + QUEUE_LEASE_SECONDS})
+        pipe.execute()
+        return payload
+
+    def heartbeat(self, job_id):
+        self._redis.zadd(self.LEASES, {job_id: time.time() + QUEUE_LEASE_SECONDS}, xx=True)
+
+    def ack(self, job_id):
+        pipe = self._redis.pipeline()
+        pipe.zrem(self.LEASES, job_id)
+        pipe.hdel(self.CLAIMED, job_id)
+        pipe.execute()
+
+
+def create_job_queue(runner, kind=JOB_QUEUE):
+    if kind == "sqlite":
+        return SQLiteQueue()
+    if kind == "redis":
+        return RedisQueue()
+    return LocalQueue(runner)
+
+
+# --- Artifacts ---
+
+class LocalArtifactStore:
+    """Archives stay in ARTIFACT_DIR (a shared volume when API and workers are separate)"""
+
+    def local_path(self, name):
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        return os.path.join(ARTIFACT_DIR, name)
+
+    def publish(self, path, name):
+        return {"kind": "local", "path": path}
+
+    def delete(self, ref):
+        if os.path.exists(ref["path"]):
+            os.remove(ref["path"])
+
+
+class S3ArtifactStore:
+    """Archives uploaded to an S3-compatible bucket (AWS, MinIO, R2...) and
+    served through presigned URLs, which support Range requests natively"""
+
+    def __init__(self):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("ARTIFACT_STORE=s3 needs the 'boto3' package (pip install boto3)")
+        if not S3_BUCKET:
+            raise RuntimeError("ARTIFACT_STORE=s3 needs S3_BUCKET")
+        self._s3 = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL)
+
+    def local_path(self, name):
+        # Staging file for the worker; removed after upload
+        return os.path.join(tempfile.gettempdir(), name)
+
+    def publish(self, path, name):
+        key = f"{S3_PREFIX}{name}"
+        self._s3.upload_file(path, S3_BUCKET, key, ExtraArgs={"ContentType": "application/zip"})
+        os.remove(path)
+        return {"kind": "s3", "bucket": S3_BUCKET, "key": key}
+
+    def delete(self, ref):
+        self._s3.delete_object(Bucket=ref["bucket"], Key=ref["key"])
+
+    def url(self, ref, filename):
+        from backend.serving import content_disposition
+        return self._s3.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": ref["bucket"],
+                "Key": ref["key"],
+                "ResponseContentDisposition": content_disposition(filename)
+            },
+            ExpiresIn=S3_URL_EXPIRY
+        )
+
+
+def create_artifact_store(kind=ARTIFACT_STORE):
+    if kind == "s3":
+        return S3ArtifactStore()
+    return LocalArtifactStore()
@@ -0,0 +1,39 @@
+import os
+import json
+from dotenv import load_dotenv
+
+# .env is read once, before any backend module reads its settings from os.environ
+load_dotenv()
+
+# Allow non-HTTPS for local dev
+os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+os.environ["OAUTHLIB_RELAX_TOKEN_SCOPE"] = "1"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Filled in by load_config() during app startup
+CLIENT_SECRETS_FILE = None
+client_config = None
+
+
+def find_client_secrets_file():
+    """CLIENT_SECRETS_FILE env var, backend/client_secret.json, then the repo root"""
+    primary = os.getenv("CLIENT_SECRETS_FILE", os.path.join(BASE_DIR, "client_secret.json"))
+    if os.path.exists(primary):
+        return primary
+    root_secret = os.path.join(os.path.dirname(BASE_DIR), "client_secret.json")
+    if os.path.exists(root_secret):
+        return root_secret
+    raise FileNotFoundError(f"client_secret.json not found at {primary} or {root_secret}")
+
+
+def load_config():
+    """Resolve and read the OAuth client secrets once per process"""
+    global CLIENT_SECRETS_FILE, client_config
+    if client_config is not None:
+        return client_config
+    CLIENT_SECRETS_FILE = find_client_secrets_file()
+    with open(CLIENT_SECRETS_FILE, "r") as f:
+        client_config = json.load(f)
+    print(f"Using secret at: {CLIENT_SECRETS_FILE}")
+    return client_config
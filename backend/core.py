@@ -1,19 +1,70 @@
 import os
 import io
+import json
+import zlib
+import shutil
 import zipfile
-from googleapiclient.discovery import build
+import tempfile
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient import discovery_cache
 from googleapiclient.http import MediaIoBaseDownload
 from typing import Generator
 import mimetypes
 
+# Discovery documents of the APIs we use, loaded once by load_discovery_documents()
+DISCOVERY_APIS = [("classroom", "v1"), ("drive", "v3")]
+_discovery_docs = {}
+
+def _touch_resources(resource, desc):
+    for name, child_desc in desc.get("resources", {}).items():
+        _touch_resources(getattr(resource, name)(), child_desc)
+
+def load_discovery_documents():
+    """Parse the discovery documents once and build every resource once.
+    googleapiclient fixes up method descriptions in place the first time a
+    resource is built; doing that here, single-threaded, makes the shared
+    dicts safe to reuse from concurrent get_service() calls afterwards."""
+    import httplib2
+    for service_name, version in DISCOVERY_APIS:
+        if (service_name, version) in _discovery_docs:
+            continue
+        doc = discovery_cache.get_static_doc(service_name, version)
+        if doc is not None:
+            doc = json.loads(doc)
+        else:
+            # Not bundled with this googleapiclient version: fetch it once
+            doc = build(service_name, version, static_discovery=False, cache_discovery=False)._rootDesc
+        _touch_resources(build_from_document(doc, http=httplib2.Http()), doc)
+        _discovery_docs[(service_name, version)] = doc
+    return list(_discovery_docs)
+
 def get_service(creds, service_name, version):
-    return build(service_name, version, credentials=creds)
+    doc = _discovery_docs.get((service_name, version))
+    if doc is None:
+        return build(service_name, version, credentials=creds)
+    return build_from_document(doc, credentials=creds)
 
-def list_courses(creds):
+def list_courses(creds, course_states=("ACTIVE",)):
+    """All courses of the user, following pagination. course_states=None means every state."""
     service = get_service(creds, "classroom", "v1")
-    results = service.courses().list(courseStates=["ACTIVE"]).execute()
-    courses = results.get("courses", [])
-    return [{"id": c["id"], "name": c["name"], "section": c.get("section", "")} for c in courses]
+    courses = []
+    page_token = None
+    while True:
+        kwargs = {"pageSize": 100, "pageToken": page_token}
+        if course_states:
+            kwargs["courseStates"] = list(course_states)
+        results = service.courses().list(**kwargs).execute()
+        courses.extend(results.get("courses", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
+    return [{
+        "id": c["id"],
+        "name": c["name"],
+        "section": c.get("section", ""),
+        "courseState": c.get("courseState"),
+        "updateTime": c.get("updateTime")
+    } for c in courses]
 
 def list_course_work(creds, course_id):
     service = get_service(creds, "classroom", "v1")
@@ -53,159 +104,478 @@ def fix_extension_if_missing(filename, mime_type):
             return filename + ext_map[mime_type]
     return filename
 
-def download_file_content(drive_service, file_id):
+def spool_file():
+    """Temp file kept in memory up to SPOOL_MAX_BYTES, on disk beyond"""
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+
+def download_file_content(drive_service, file_id, on_progress=None, control=None):
+    """Download a Drive file into a spool_file(), returned rewound; the caller closes it.
+    on_progress(byte_count) is called with the bytes received per chunk;
+    control (a JobControl) is checked for cancellation between chunks."""
     request = drive_service.files().get_media(fileId=file_id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
+    fh = spool_file()
+    downloader = MediaIoBaseDownload(fh, request, chunksize=DOWNLOAD_CHUNK_SIZE)
     done = False
+    received = 0
     while not done:
+        if control:
+            control.check_cancelled()
         status, done = downloader.next_chunk()
+        if on_progress:
+            on_progress(fh.tell() - received)
+        received = fh.tell()
     fh.seek(0)
-    return fh.read()
+    return fh
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+# Docs, Sheets, Slides, Forms...: native Google files have no binary content for get_media
+GOOGLE_APPS_MIME_PREFIX = "application/vnd.google-apps."
+DRIVE_PAGE_SIZE = 1000
+
+def never_downloadable(file_data, error):
+    """True when a failed download fails the same way every time: native
+    Google files, refused by Drive with 403 fileNotDownloadable ("Use Export")"""
+    if (file_data.get("mimeType") or "").startswith(GOOGLE_APPS_MIME_PREFIX):
+        return True
+    status = getattr(getattr(error, "resp", None), "status", None)
+    return status == 403 and "fileNotDownloadable" in str(error)
 
-def traverse_and_collect(drive_service, folder_id, path_prefix, collected_files):
-    """Recursive traversal of Drive Folder"""
+def drive_file_entry(f, path_prefix):
+    """Manifest entry for a file returned by Drive files().list"""
+    name = safe_name(f.get("name", f["id"]))
+    return {
+        "id": f["id"],
+        "path": os.path.join(path_prefix, name),
+        "name": name,
+        "mimeType": f.get("mimeType"),
+        "size": int(f["size"]) if f.get("size") else None,
+        "md5Checksum": f.get("md5Checksum"),
+        "modifiedTime": f.get("modifiedTime")
+    }
+
+def attachment_entry(df, folder_name):
+    """Manifest entry for a Classroom driveFile attachment"""
+    f_name = safe_name(df.get("title") or df.get("name") or df["id"])
+    mime = df.get("mimeType")
+    if not mime:
+        mime, _ = mimetypes.guess_type(f_name)
+    return {
+        "id": df["id"],
+        "path": os.path.join(folder_name, f_name),
+        "name": f_name,
+        "mimeType": mime,
+        # Classroom attachments carry no Drive metadata; filled in before download
+        "size": None,
+        "md5Checksum": None,
+        "modifiedTime": None
+    }
+
+def list_drive_folder_page(drive_service, folder_id, page_token=None, page_size=DRIVE_PAGE_SIZE):
+    """One page of a Drive folder's children"""
     query = f"'{folder_id}' in parents and trashed = false"
+    return drive_service.files().list(
+        q=query,
+        fields="nextPageToken, files(id, name, mimeType, size, md5Checksum, modifiedTime)",
+        pageToken=page_token,
+        pageSize=page_size
+    ).execute()
+
+def iter_drive_folder(drive_service, folder_id, path_prefix, control=None):
+    """Yield manifest entries for every file below a Drive folder.
+    control (a JobControl) is checked for cancellation before each page."""
     page_token = None
     while True:
-        resp = drive_service.files().list(q=query, fields="nextPageToken, files(id, name, mimeType)", pageToken=page_token).execute()
-        files = resp.get("files", [])
-        for f in files:
-            name = safe_name(f.get("name", f["id"]))
-            if f.get("mimeType") == "application/vnd.google-apps.folder":
-                new_prefix = os.path.join(path_prefix, name)
-                traverse_and_collect(drive_service, f["id"], new_prefix, collected_files)
+        if control:
+            control.check_cancelled()
+        resp = list_drive_folder_page(drive_service, folder_id, page_token)
+        for f in resp.get("files", []):
+            if f.get("mimeType") == FOLDER_MIME:
+                new_prefix = os.path.join(path_prefix, safe_name(f.get("name", f["id"])))
+                yield from iter_drive_folder(drive_service, f["id"], new_prefix, control)
             else:
-                full_path = os.path.join(path_prefix, name)
-                # Store dict with metadata
-                collected_files.append({
-                    "id": f["id"],
-                    "path": full_path,
-                    "name": name,
-                    "mimeType": f.get("mimeType")
-                })
-        
+                yield drive_file_entry(f, path_prefix)
+
         page_token = resp.get("nextPageToken")
         if not page_token:
             break
 
-def collect_course_materials(classroom_service, drive_service, course_id):
+def iter_course_posts(classroom_service, course_id):
+    """Yield (kind, folder_name, post) for announcements, coursework materials
+    and coursework, following Classroom pagination"""
+    courses = classroom_service.courses()
+    sources = [
+        ("announcement", courses.announcements, "announcements"),
+        ("courseWorkMaterial", courses.courseWorkMaterials, "courseWorkMaterial"),
+        ("courseWork", courses.courseWork, "courseWork"),
+    ]
+    for kind, resource, key in sources:
+        page_token = None
+        while True:
+            resp = resource().list(courseId=course_id, pageToken=page_token).execute()
+            for post in resp.get(key, []):
+                if kind == "announcement":
+                    folder_name = get_folder_name(post.get("title"), post.get("text"))
+                else:
+                    folder_name = get_folder_name(post.get("title"))
+                yield kind, folder_name, post
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                break
+
+def iter_post_drive_files(post):
+    for m in post.get("materials", []):
+        if "driveFile" in m:
+            yield m["driveFile"]["driveFile"]
+
+def iter_course_materials(classroom_service, drive_service, course_id, control=None):
+    """Yield file dictionaries as the course is scanned.
+    control (a JobControl) is checked for cancellation between posts and Drive folder pages."""
+    for kind, folder_name, post in iter_course_posts(classroom_service, course_id):
+        if control:
+            control.check_cancelled()
+        for df in iter_post_drive_files(post):
+            if df.get("mimeType") == FOLDER_MIME:
+                entries = iter_drive_folder(drive_service, df["id"], folder_name, control)
+            else:
+                entries = [attachment_entry(df, folder_name)]
+            for entry in entries:
+                # The owning post
+                entry["postId"] = post["id"]
+                yield entry
+
+def collect_course_materials(classroom_service, drive_service, course_id, control=None):
     """
     Returns a list of file dictionaries
     """
-    collected_files = [] # List of dicts
-
-    # Announcements
-    anns_resp = classroom_service.courses().announcements().list(courseId=course_id).execute()
-    anns = anns_resp.get("announcements", [])
-    for a in anns:
-        folder_name = get_folder_name(a.get("title"), a.get("text"))
-        for m in a.get("materials", []):
-            if "driveFile" in m:
-                df = m["driveFile"]["driveFile"]
-                f_name = safe_name(df.get("title") or df.get("name") or df["id"])
-                if df.get("mimeType") == "application/vnd.google-apps.folder":
-                     traverse_and_collect(drive_service, df["id"], folder_name, collected_files)
-                else:
-                    mime = df.get("mimeType")
-                    if not mime:
-                        mime, _ = mimetypes.guess_type(f_name)
-                    collected_files.append({
-                        "id": df["id"],
-                        "path": os.path.join(folder_name, f_name),
-                        "name": f_name,
-                        "mimeType": mime
-                    })
-
-    # Coursework Materials
-    mats_resp = classroom_service.courses().courseWorkMaterials().list(courseId=course_id).execute()
-    mats = mats_resp.get("courseWorkMaterial", [])
-    for mat in mats:
-        folder_name = get_folder_name(mat.get("title"))
-        for m in mat.get("materials", []):
-            if "driveFile" in m:
-                df = m["driveFile"]["driveFile"]
-                f_name = safe_name(df.get("title") or df.get("name") or df["id"])
-                if df.get("mimeType") == "application/vnd.google-apps.folder":
-                     traverse_and_collect(drive_service, df["id"], folder_name, collected_files)
-                else:
-                    mime = df.get("mimeType")
-                    if not mime:
-                        mime, _ = mimetypes.guess_type(f_name)
-                    collected_files.append({
-                        "id": df["id"],
-                        "path": os.path.join(folder_name, f_name),
-                        "name": f_name,
-                        "mimeType": mime
-                    })
-
-    # Coursework (Assignments)
-    works_resp = classroom_service.courses().courseWork().list(courseId=course_id).execute()
-    works = works_resp.get("courseWork", [])
-    for w in works:
-        folder_name = get_folder_name(w.get("title"))
-        for m in w.get("materials", []):
-            if "driveFile" in m:
-                df = m["driveFile"]["driveFile"]
-                f_name = safe_name(df.get("title") or df.get("name") or df["id"])
-                if df.get("mimeType") == "application/vnd.google-apps.folder":
-                     traverse_and_collect(drive_service, df["id"], folder_name, collected_files)
-                else:
-                    mime = df.get("mimeType")
-                    if not mime:
-                        mime, _ = mimetypes.guess_type(f_name)
-                    collected_files.append({
-                        "id": df["id"],
-                        "path": os.path.join(folder_name, f_name),
-                        "name": f_name,
-                        "mimeType": mime
-                    })
+    return list(iter_course_materials(classroom_service, drive_service, course_id, control))
+
+def course_material_tree(classroom_service, course_id):
+    """Top-level posts with their attachments. Drive folders are returned as
+    unexpanded nodes, to be opened with drive_folder_page()."""
+    posts = []
+    for kind, folder_name, post in iter_course_posts(classroom_service, course_id):
+        items = []
+        for df in iter_post_drive_files(post):
+            if df.get("mimeType") == FOLDER_MIME:
+                items.append({
+                    "id": df["id"],
+                    "name": safe_name(df.get("title") or df["id"]),
+                    # Folder contents are placed directly under the post folder
+                    "path": folder_name,
+                    "mimeType": FOLDER_MIME,
+                    "isFolder": True
+                })
+            else:
+                items.append(attachment_entry(df, folder_name))
+        if items:
+            posts.append({"id": post["id"], "kind": kind, "title": folder_name, "items": items})
+    return posts
 
-    return collected_files
+def drive_folder_page(drive_service, folder_id, path_prefix, cursor=None, page_size=100):
+    """Direct children of a Drive folder, one page at a time.
+    The cursor is the Drive pageToken."""
+    resp = list_drive_folder_page(drive_service, folder_id, cursor, page_size)
+    items = []
+    for f in resp.get("files", []):
+        if f.get("mimeType") == FOLDER_MIME:
+            name = safe_name(f.get("name", f["id"]))
+            items.append({
+                "id": f["id"],
+                "name": name,
+                "path": os.path.join(path_prefix, name),
+                "mimeType": FOLDER_MIME,
+                "isFolder": True
+            })
+        else:
+            items.append(drive_file_entry(f, path_prefix))
+    return {"items": items, "nextCursor": resp.get("nextPageToken")}
 
 
 import threading
 import uuid
-import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
+from backend.backends import create_job_store, create_job_queue, create_artifact_store, LocalQueue, PriorityGate
+
+# Job state and archives, shared with other API nodes / workers when configured
+job_store = create_job_store()
+artifact_store = create_artifact_store()
 
-# Simple in-memory job store
-jobs = {}
+# Smallest archive part a job may ask for, so a part holds more than a file or two
+MIN_PART_SIZE_MB = 100
+# Parallel Drive downloads per job; each worker gets its own Drive client
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Drive accepts up to 100 calls per batch request
+METADATA_BATCH_SIZE = 100
+# Compression stage: deflate runs in its own threads (zlib releases the GIL),
+# so it uses every core while downloads keep going
+COMPRESS_WORKERS = int(os.getenv("COMPRESS_WORKERS", str(os.cpu_count() or 2)))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_CHUNK_SIZE = 1024 * 1024
+# Downloaded and compressed members stay in memory up to this size, larger ones
+# spill to a temp file, so RAM per pending member is bounded whatever the file size
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+STORED_MIME_PREFIXES = (
+    "video/", "audio/", "image/jpeg", "image/png", "image/gif", "image/webp",
+    "application/zip", "application/gzip", "application/x-7z-compressed", "application/x-rar-compressed"
+)
 
-def update_job(job_id, status, progress=0, message="", file_path=None, filename=None):
-    if job_id in jobs:
-        jobs[job_id].update({
-            "status": status,
-            "progress": progress,
-            "message": message,
-            "file_path": file_path,
-            "filename": filename
-        })
+# How many jobs run at once in this process; the rest wait, most urgent first
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+job_gate = PriorityGate(MAX_CONCURRENT_JOBS)
+# Selections up to this many files go ahead of bigger jobs
+SMALL_JOB_FILES = int(os.getenv("SMALL_JOB_FILES", "25"))
+CANCEL_CHECK_INTERVAL = 1.0
+FINISHED_STATES = ("COMPLETED", "FAILED", "CANCELLED")
 
-def download_file_content_to_zip(drive_service, file_id, zip_file, zip_path):
+class JobCancelled(Exception):
+    pass
+
+class JobControl:
+    """Cooperative cancellation and preemption for one running job.
+    Download threads call checkpoint() between files and check_cancelled()
+    between chunks."""
+
+    def __init__(self, job_id, priority, gate=None):
+        self.job_id = job_id
+        self.priority = priority
+        self.gate = gate
+        self.cancelled = False
+        self._last_check = 0
+        self._lock = threading.Lock()
+
+    def check_cancelled(self):
+        # The store is read at most once per CANCEL_CHECK_INTERVAL
+        if not self.cancelled and time.time() - self._last_check >= CANCEL_CHECK_INTERVAL:
+            self._last_check = time.time()
+            self.cancelled = job_store.is_cancel_requested(self.job_id)
+        if self.cancelled:
+            raise JobCancelled()
+
+    def checkpoint(self):
+        # One thread of the job yields the slot; the others wait on the lock,
+        # so the whole job pauses while a more urgent one runs
+        with self._lock:
+            self.check_cancelled()
+            if self.gate and self.gate.yield_to_waiting(self.priority):
+                self.check_cancelled()
+
+def job_priority(selected_ids, delta=False):
+    """Lower runs first: small selections, then delta downloads, then full-course exports"""
+    if selected_ids is not None and len(selected_ids) <= SMALL_JOB_FILES:
+        return 0
+    if delta:
+        return 1
+    return 2
+
+def update_job(job_id, status, progress=0, message="", artifact=None, filename=None, **extra):
+    job_store.update(
+        job_id,
+        status=status,
+        progress=progress,
+        message=message,
+        artifact=artifact,
+        filename=filename,
+        **extra
+    )
+
+def fill_missing_metadata(drive_service, files, control=None):
+    """Fetch size/md5Checksum/modifiedTime for manifest entries that came from
+    Classroom attachments, METADATA_BATCH_SIZE lookups per batched HTTP request.
+    control (a JobControl) is checked for cancellation between batches."""
+    missing = [f for f in files if f.get("modifiedTime") is None]
+    for start in range(0, len(missing), METADATA_BATCH_SIZE):
+        if control:
+            control.check_cancelled()
+        chunk = missing[start:start + METADATA_BATCH_SIZE]
+
+        def on_response(request_id, meta, error, chunk=chunk):
+            f = chunk[int(request_id)]
+            if error is not None:
+                print(f"Could not fetch metadata for {f['path']}: {error}")
+                return
+            f["size"] = int(meta["size"]) if meta.get("size") else None
+            f["md5Checksum"] = meta.get("md5Checksum")
+            f["modifiedTime"] = meta.get("modifiedTime")
+
+        batch = drive_service.new_batch_http_request(callback=on_response)
+        for i, f in enumerate(chunk):
+            batch.add(drive_service.files().get(fileId=f["id"], fields="size, md5Checksum, modifiedTime"),
+                      request_id=str(i))
+        try:
+            batch.execute()
+        except Exception as e:
+            print(f"Could not fetch metadata for {len(chunk)} files: {e}")
+
+def course_changes(drive_service, files, snapshot, control=None):
+    """Entries of the manifest that are new or changed since the snapshot.
+    When the snapshot has a start token, the Drive changes feed tells which
+    attachments can skip their metadata lookup."""
+    from backend import snapshots
+    changed_ids = snapshots.drive_changed_ids(drive_service, snapshot.get("startPageToken"))
+    snapshots.reuse_known_metadata(files, snapshot, changed_ids)
+    fill_missing_metadata(drive_service, files, control)
+    return snapshots.new_or_changed(files, snapshot)
+
+def deflate_entry(zip_path, src, mime_type=None):
+    """Build the ZipInfo and payload of an archive member from the file src,
+    outside any zip lock. zlib releases the GIL while compressing, so entries
+    deflate in parallel threads. The payload is src itself (stored) or a new
+    spool_file() (deflated); either way rewound, and the caller closes it."""
+    zinfo = zipfile.ZipInfo(zip_path, date_time=time.localtime(time.time())[:6])
+    zinfo.external_attr = 0o600 << 16
+    # Already-compressed media gains nothing from deflate
+    deflate = not (mime_type or "").startswith(STORED_MIME_PREFIXES)
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15) if deflate else None
+    deflated = spool_file() if deflate else None
+    crc, size = 0, 0
+    while True:
+        chunk = src.read(COMPRESS_CHUNK_SIZE)
+        if not chunk:
+            break
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        if deflate:
+            deflated.write(compressor.compress(chunk))
+    zinfo.file_size = size
+    zinfo.CRC = crc
+    src.seek(0)
+    if deflate:
+        deflated.write(compressor.flush())
+        if deflated.tell() < size:
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            zinfo.compress_size = deflated.tell()
+            deflated.seek(0)
+            src.close()
+            return zinfo, deflated
+        deflated.close()
+    zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.compress_size = size
+    return zinfo, src
+
+def write_precompressed(zip_file, zinfo, payload):
+    """Append a member prepared by deflate_entry. Does what ZipFile.writestr
+    does once the data is compressed: local header, data, bookkeeping for the
+    central directory. The caller holds the zip's lock.
+    Uses ZipFile internals; PRECOMPRESSED_WRITES tells whether they work here."""
+    zip_file._writecheck(zinfo)
+    zip_file._didModify = True
+    zip_file.fp.seek(zip_file.start_dir)
+    zinfo.header_offset = zip_file.fp.tell()
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    zip_file.fp.write(zinfo.FileHeader(zip64))
+    shutil.copyfileobj(payload, zip_file.fp, COMPRESS_CHUNK_SIZE)
+    zip_file.start_dir = zip_file.fp.tell()
+    zip_file.filelist.append(zinfo)
+    zip_file.NameToInfo[zinfo.filename] = zinfo
+
+def write_member(zip_file, zip_path, src, mime_type=None):
+    """Compress and write src inside zipfile itself, under the zip lock.
+    Used when PRECOMPRESSED_WRITES is off."""
+    zinfo = zipfile.ZipInfo(zip_path, date_time=time.localtime(time.time())[:6])
+    zinfo.external_attr = 0o600 << 16
+    if (mime_type or "").startswith(STORED_MIME_PREFIXES):
+        zinfo.compress_type = zipfile.ZIP_STORED
+    else:
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+    with zip_file.open(zinfo, "w", force_zip64=True) as dest:
+        shutil.copyfileobj(src, dest, COMPRESS_CHUNK_SIZE)
+
+def _precompressed_writes_work():
+    """write_precompressed relies on ZipFile internals (_writecheck,
+    _didModify, start_dir, fp, filelist, NameToInfo) that are not part of
+    the public API. Check once that an archive written with it reads back."""
     try:
-        request = drive_service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-        fh.seek(0)
-        zip_file.writestr(zip_path, fh.read())
-        return True
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", allowZip64=True) as zip_file:
+            for name, data, mime in (("a.txt", b"abc" * 1000, "text/plain"), ("b.png", b"\x89PNG", "image/png")):
+                src = io.BytesIO(data)
+                zinfo, payload = deflate_entry(name, src, mime)
+                write_precompressed(zip_file, zinfo, payload)
+            zip_file.writestr("c.txt", b"after")
+        with zipfile.ZipFile(buf) as zip_file:
+            return zip_file.testzip() is None and zip_file.read("a.txt") == b"abc" * 1000 \
+                and zip_file.namelist() == ["a.txt", "b.png", "c.txt"]
     except Exception as e:
-        print(f"Error downloading {zip_path}: {e}")
-        zip_file.writestr(f"{zip_path}.error.txt", f"Failed: {e}")
+        print(f"Parallel compression disabled, zipfile internals changed: {e}")
         return False
 
-def background_zip_task(creds, course_id, job_id, course_name, selected_ids=None):
+PRECOMPRESSED_WRITES = _precompressed_writes_work()
+
+def format_eta(seconds):
+    if seconds is None:
+        return ""
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes}m left"
+    if minutes:
+        return f"{minutes}m {secs}s left"
+    return f"{secs}s left"
+
+def part_zip(part):
+    """The part's ZipFile, created on first use. The caller holds part["lock"]."""
+    if part["zip"] is None:
+        # ZIP64 lets a single part or member exceed 4 GB
+        part["zip"] = zipfile.ZipFile(part["file_path"], "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+    return part["zip"]
+
+def close_part_zip(part):
+    with part["lock"]:
+        if part["zip"] is not None:
+            part["zip"].close()
+
+def discard_parts(job_id, parts, parts_view, status):
+    """Remove every archive of a job that is not going to complete, published
+    (local or S3) or not, and mark its parts so none is served"""
+    for part, view in zip(parts, parts_view):
+        close_part_zip(part)
+        try:
+            if view.get("artifact"):
+                artifact_store.delete(view["artifact"])
+            elif os.path.exists(part["file_path"]):
+                os.remove(part["file_path"])
+        except Exception as e:
+            print(f"Could not remove {part['filename']}: {e}")
+        view.update(status=status, size=None, artifact=None)
+    if parts_view:
+        job_store.update(job_id, parts=parts_view)
+
+def plan_parts(files, part_size=None):
+    """Split the (largest-first) manifest into archive parts of at most part_size bytes.
+    First-fit decreasing; a single file bigger than part_size gets a part of its own."""
+    if not part_size:
+        return [list(files)]
+    parts = []
+    for f in files:
+        size = f.get("size") or 0
+        for part in parts:
+            if part["bytes"] + size <= part_size:
+                part["files"].append(f)
+                part["bytes"] += size
+                break
+        else:
+            parts.append({"files": [f], "bytes": size})
+    return [p["files"] for p in parts]
+
+def background_zip_task(creds, course_id, job_id, course_name, selected_ids=None, part_size=None,
+                        delta=False, user_id=None, control=None):
+    from backend import snapshots
+    control = control or JobControl(job_id, job_priority(selected_ids, delta))
+    parts = []
+    parts_view = []
     try:
         update_job(job_id, "PROCESSING", 0, "Scanning course materials...")
         
         classroom_service = get_service(creds, "classroom", "v1")
         drive_service = get_service(creds, "drive", "v3")
 
-        all_files = collect_course_materials(classroom_service, drive_service, course_id)
+        # Taken before scanning so nothing that changes mid-job is missed next time
+        start_page_token = snapshots.get_start_page_token(drive_service) if user_id else None
+        snapshot = snapshots.load_snapshot(user_id, course_id) if delta else None
+
+        all_files = collect_course_materials(classroom_service, drive_service, course_id, control)
         
         # Filter if selected_ids is provided
         if selected_ids is not None:
@@ -221,47 +591,351 @@ def background_zip_task(creds, course_id, job_id, course_name, selected_ids=None
             update_job(job_id, "FAILED", 0, "No files selected or found.")
             return
 
-        # Create temp file
-        temp_dir = tempfile.gettempdir()
+        if snapshot:
+            update_job(job_id, "PROCESSING", 0, "Checking for new and changed files...")
+            files_to_download = course_changes(drive_service, files_to_download, snapshot, control)
+            total_files = len(files_to_download)
+            if total_files == 0:
+                update_job(job_id, "FAILED", 0, "Nothing new since your last download.")
+                return
+
+        fill_missing_metadata(drive_service, files_to_download, control)
+        control.check_cancelled()
+        # Largest first so the biggest downloads don't form the tail of the job
+        files_to_download.sort(key=lambda f: f.get("size") or 0, reverse=True)
+        total_bytes = sum(f.get("size") or 0 for f in files_to_download)
+
+        # Create archive files, one per part
         safe_course_name = safe_name(course_name)
-        zip_filename = f"{safe_course_name}.zip"
-        temp_zip_path = os.path.join(temp_dir, f"gcr_{job_id}.zip")
-
-        update_job(job_id, "PROCESSING", 0, f"Preparing to download {total_files} files...")
-
-        with zipfile.ZipFile(temp_zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-            for idx, file_data in enumerate(files_to_download):
-                path = file_data["path"]
-                file_id = file_data["id"]
-                mime_type = file_data["mimeType"]
-                
-                # Update progress
-                percent = int((idx / total_files) * 100)
-                update_job(job_id, "PROCESSING", percent, f"Downloading {os.path.basename(path)}...")
-                
-                final_name = fix_extension_if_missing(path, mime_type)
-                download_file_content_to_zip(drive_service, file_id, zf, final_name)
-
-        update_job(job_id, "COMPLETED", 100, "Download ready!", file_path=temp_zip_path, filename=zip_filename)
+        planned = plan_parts(files_to_download, part_size)
+        for number, part_files in enumerate(planned, start=1):
+            if len(planned) == 1:
+                filename = f"{safe_course_name}.zip"
+                file_path = artifact_store.local_path(f"gcr_{job_id}.zip")
+            else:
+                filename = f"{safe_course_name}.part{number:03d}.zip"
+                file_path = artifact_store.local_path(f"gcr_{job_id}.part{number:03d}.zip")
+            parts.append({
+                "number": number,
+                "filename": filename,
+                "file_path": file_path,
+                "files": part_files,
+                "remaining": len(part_files),
+                # Members are written in manifest order: index of the next one,
+                # and finished members waiting for their turn
+                "next": 0,
+                "ready": {},
+                "lock": threading.Lock(),
+                # Opened by part_zip() on the first write, so only parts in progress hold a file handle
+                "zip": None,
+            })
+        # Public view of the parts, exposed through the status endpoint
+        parts_view.extend(
+            {"number": part["number"], "filename": part["filename"], "status": "PENDING", "size": None}
+            for part in parts
+        )
+        job_store.update(job_id, parts=parts_view)
+
+        update_job(job_id, "PROCESSING", 0, f"Preparing to download {total_files} files...",
+                   bytes_done=0, total_bytes=total_bytes, eta_seconds=None)
+
+        progress_lock = threading.Lock()
+        state = {"bytes_done": 0, "files_done": 0, "current": ""}
+        downloaded = []
+        # Failed for good (native Google files); retrying them in the next delta would fail again
+        undownloadable = []
+        started = time.time()
+        local = threading.local()
+
+        def report(byte_count):
+            with progress_lock:
+                state["bytes_done"] += byte_count
+                bytes_done = state["bytes_done"]
+                elapsed = time.time() - started
+                if total_bytes:
+                    percent = min(int(bytes_done * 100 / total_bytes), 99)
+                else:
+                    percent = int(state["files_done"] * 100 / total_files)
+                eta = None
+                if total_bytes and bytes_done and elapsed > 0:
+                    eta = max(total_bytes - bytes_done, 0) / (bytes_done / elapsed)
+                update_job(job_id, "PROCESSING", percent,
+                           f"Downloading {state['current']}... {format_eta(eta)}".strip(),
+                           bytes_done=bytes_done, total_bytes=total_bytes,
+                           eta_seconds=int(eta) if eta is not None else None)
+
+        def finalize_part(part):
+            close_part_zip(part)
+            # A cancelled job publishes nothing more; discard_parts removes the file
+            if control.cancelled:
+                return
+            size = os.path.getsize(part["file_path"])
+            artifact = artifact_store.publish(part["file_path"], os.path.basename(part["file_path"]))
+            with progress_lock:
+                view = parts_view[part["number"] - 1]
+                view.update(size=size, status="READY", artifact=artifact)
+                job_store.update(job_id, parts=parts_view)
+
+        def finish_file(part, file_data, ok):
+            with progress_lock:
+                state["files_done"] += 1
+                if ok:
+                    downloaded.append(file_data)
+                part["remaining"] -= 1
+                part_done = part["remaining"] == 0
+            # Each part is downloadable as soon as its last member is written
+            if part_done:
+                finalize_part(part)
+
+        # Members downloaded but not yet written; each holds at most
+        # SPOOL_MAX_BYTES of memory, the rest of a big file is on disk
+        order = threading.Condition()
+        pending_count = [0]
+        max_pending = COMPRESS_WORKERS * 2
+        # Set when a download thread dies without handing in its member: the
+        # members behind it would never get their turn, so the job fails instead
+        aborted = []
+
+        def reserve(part, index):
+            # The next member of a part never waits, or the members behind it would wait forever
+            with order:
+                while pending_count[0] >= max_pending and index != part["next"]:
+                    order.wait(CANCEL_CHECK_INTERVAL)
+                    control.check_cancelled()
+                    if aborted:
+                        raise RuntimeError(f"Job aborted: {aborted[0]}")
+                pending_count[0] += 1
+
+        # Entries are (kind, file_data, name, payload, zinfo):
+        #   "deflated": payload prepared by deflate_entry, described by zinfo
+        #   "raw":      downloaded file, compressed by zipfile while writing
+        #   "error":    payload is the error message
+        # Never raises: a member that can't be written (part file not created,
+        # disk full) counts as failed, so the members queued behind it still get their turn
+        def write_entry(part, entry):
+            kind, file_data, name, payload, zinfo = entry
+            try:
+                zip_file = part_zip(part)
+                if kind == "error":
+                    zip_file.writestr(f"{name}.error.txt", payload)
+                    return False
+                if kind == "raw":
+                    write_member(zip_file, name, payload, file_data["mimeType"])
+                else:
+                    write_precompressed(zip_file, zinfo, payload)
+                return True
+            except Exception as e:
+                print(f"Error writing {name}: {e}")
+                return False
+            finally:
+                if kind != "error":
+                    payload.close()
+
+        def write_in_order(part, index, entry):
+            """Hand in a finished member; whichever thread completes the next
+            one in order writes it and every member queued behind it"""
+            written = []
+            with part["lock"]:
+                part["ready"][index] = entry
+                while part["next"] in part["ready"]:
+                    entry = part["ready"].pop(part["next"])
+                    part["next"] += 1
+                    written.append((entry[1], write_entry(part, entry)))
+            if written:
+                with order:
+                    pending_count[0] -= len(written)
+                    order.notify_all()
+            for file_data, ok in written:
+                finish_file(part, file_data, ok)
+
+        def compress_and_write(part, index, file_data, final_name, data):
+            try:
+                if PRECOMPRESSED_WRITES:
+                    zinfo, payload = deflate_entry(final_name, data, file_data["mimeType"])
+                    entry = ("deflated", file_data, final_name, payload, zinfo)
+                else:
+                    entry = ("raw", file_data, final_name, data, None)
+            except Exception as e:
+                print(f"Error compressing {final_name}: {e}")
+                data.close()
+                entry = ("error", file_data, final_name, f"Failed: {e}", None)
+            write_in_order(part, index, entry)
+
+        def download_one(item):
+            try:
+                download_and_hand_off(item)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                with order:
+                    aborted.append(e)
+                    order.notify_all()
+                raise
+
+        def download_and_hand_off(item):
+            part, index, file_data = item
+            # googleapiclient services are not thread-safe, so build one per worker
+            if not hasattr(local, "drive_service"):
+                local.drive_service = get_service(creds, "drive", "v3")
+            # Stops here once cancelled; pauses while a more urgent job has our slot
+            control.checkpoint()
+            if aborted:
+                raise RuntimeError(f"Job aborted: {aborted[0]}")
+            path = file_data["path"]
+            expected = file_data.get("size") or 0
+            with progress_lock:
+                state["current"] = os.path.basename(path)
+
+            received = [0]
+            def on_progress(byte_count):
+                received[0] += byte_count
+                report(byte_count)
+
+            final_name = fix_extension_if_missing(path, file_data["mimeType"])
+            try:
+                # Files without a known size don't count towards the byte total
+                data = download_file_content(local.drive_service, file_data["id"], on_progress if expected else None,
+                                             control)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                print(f"Error downloading {final_name}: {e}")
+                if never_downloadable(file_data, e):
+                    with progress_lock:
+                        undownloadable.append(file_data)
+                report(expected - received[0])
+                reserve(part, index)
+                write_in_order(part, index, ("error", file_data, final_name, f"Failed: {e}", None))
+                return
+            # Keep the byte total consistent when the manifest size was off
+            report(expected - received[0])
+
+            # Hand off to the compression stage and go on with the next download;
+            # reserve() bounds how many members wait between download and write
+            try:
+                reserve(part, index)
+            except Exception:
+                data.close()
+                raise
+            pending.append(compress_pool.submit(compress_and_write, part, index, file_data, final_name, data))
+
+        # Queue part by part so early parts finish (and become downloadable) first,
+        # while workers still overlap across part boundaries
+        work = [(part, index, f) for part in parts for index, f in enumerate(part["files"])]
+        pending = []
+        try:
+            with ThreadPoolExecutor(max_workers=COMPRESS_WORKERS) as compress_pool:
+                with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+                    list(pool.map(download_one, work))
+                for future in pending:
+                    future.result()
+        finally:
+            for part in parts:
+                close_part_zip(part)
+                # Members left unwritten by a cancelled job
+                for entry in part["ready"].values():
+                    if entry[0] != "error":
+                        entry[3].close()
+
+        # Failed files stay out of the snapshot so the next delta retries them, except
+        # those that can never be downloaded: they are known as of their modifiedTime
+        # and come back only once edited
+        known = downloaded + undownloadable
+        known_ids = {f["id"] for f in known}
+        snapshots.record_download(user_id, course_id, known,
+                                  [f for f in files_to_download if f["id"] not in known_ids],
+                                  start_page_token, covers_course=selected_ids is None)
+
+        update_job(job_id, "COMPLETED", 100, "Download ready!",
+                   artifact=parts_view[0]["artifact"] if len(parts) == 1 else None,
+                   filename=parts[0]["filename"] if len(parts) == 1 else None,
+                   bytes_done=total_bytes, total_bytes=total_bytes, eta_seconds=0)
+
+    except JobCancelled:
+        discard_parts(job_id, parts, parts_view, "CANCELLED")
+        update_job(job_id, "CANCELLED", 0, "Download cancelled.")
 
     except Exception as e:
         import traceback
         traceback.print_exc()
+        discard_parts(job_id, parts, parts_view, "FAILED")
         update_job(job_id, "FAILED", 0, str(e))
 
-def start_zip_job(creds, course_id, course_name, selected_ids=None):
+def run_job(payload):
+    """Run a queued job. Workers rebuild the user's credentials from the
+    payload; in-process runs reuse the live session object."""
+    job_id = payload["job_id"]
+    priority = payload.get("priority", 1)
+    creds = payload.get("live_credentials")
+    if creds is None:
+        from backend import config, sessions
+        creds = sessions.credentials_from_data(payload["credentials"], config.load_config()["web"])
+
+    # Cancelled while queued: no need to wait for a slot
+    job = job_store.get(job_id)
+    if job is not None and job["status"] in FINISHED_STATES:
+        return
+
+    job_gate.acquire(priority)
+    try:
+        # Claimed again after its worker died, but it had already finished
+        job = job_store.get(job_id)
+        if job is not None and job["status"] in FINISHED_STATES:
+            return
+        # Cancelled while it was still waiting for a slot
+        if job_store.is_cancel_requested(job_id):
+            update_job(job_id, "CANCELLED", 0, "Download cancelled.")
+            return
+        background_zip_task(
+            creds, payload["course_id"], job_id, payload["course_name"],
+            payload.get("selected_ids"), payload.get("part_size"), payload.get("delta", False), payload.get("user_id"),
+            JobControl(job_id, priority, job_gate)
+        )
+    finally:
+        job_gate.release()
+
+job_queue = create_job_queue(run_job)
+JOB_QUEUE_IS_LOCAL = isinstance(job_queue, LocalQueue)
+
+def start_zip_job(creds, course_id, course_name, selected_ids=None, part_size_mb=None, delta=False, user_id=None):
+    from backend.sessions import credentials_to_data
     job_id = str(uuid.uuid4())
-    jobs[job_id] = {
+    priority = job_priority(selected_ids, delta)
+    job_store.create(job_id, {
         "status": "QUEUED",
         "progress": 0,
         "message": "Queued...",
+        "priority": priority,
         "created_at": time.time()
+    })
+
+    payload = {
+        "job_id": job_id,
+        "course_id": course_id,
+        "course_name": course_name,
+        "selected_ids": selected_ids,
+        "part_size": part_size_mb * 1024 * 1024 if part_size_mb else None,
+        "delta": delta,
+        "user_id": user_id,
+        "priority": priority,
+        "credentials": credentials_to_data(creds)
     }
-    
-    # Start thread
-    t = threading.Thread(target=background_zip_task, args=(creds, course_id, job_id, course_name, selected_ids))
-    t.start()
+    if JOB_QUEUE_IS_LOCAL:
+        payload["live_credentials"] = creds
+    job_queue.submit(payload)
     
     return job_id
 
-
+def cancel_job(job_id):
+    """Ask a queued or running job to stop. Returns the job's status after
+    the request, or None if it already finished."""
+    job = job_store.get(job_id)
+    if job is None or job["status"] in FINISHED_STATES:
+        return None
+    job_store.request_cancel(job_id)
+    # Not started yet: run_job skips finished jobs, so it is cancelled right away.
+    # The request above still stops it if a worker picks it up meanwhile.
+    if job["status"] == "QUEUED":
+        update_job(job_id, "CANCELLED", 0, "Download cancelled.")
+        return "CANCELLED"
+    return "CANCELLING"
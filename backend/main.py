@@ -1,11 +1,49 @@
+from backend import config  # loads .env before other backend modules read settings
+from contextlib import asynccontextmanager
+import json
+import time
+import traceback
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from backend.serving import archive_response
 
 from starlette.middleware.sessions import SessionMiddleware
-from backend.auth import router as auth_router, get_credentials
+from backend.auth import router as auth_router, get_credentials, get_user_id
+from backend.core import (
+    job_store, artifact_store, get_service, start_zip_job, cancel_job, collect_course_materials, course_changes,
+    course_material_tree, drive_folder_page, iter_course_materials, load_discovery_documents, MIN_PART_SIZE_MB
+)
+from backend.warmup import get_active_courses, get_materials, warm_materials
+from backend.snapshots import load_snapshot
 import os
 
-app = FastAPI(title="Google Classroom Downloader API")
+# Startup state, reported by /readyz
+startup = {"ready": False, "errors": [], "started_at": None}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Everything a first request would otherwise pay for: client secrets and
+    # the parsed Classroom/Drive discovery documents.
+    started = time.time()
+    try:
+        config.load_config()
+    except Exception as e:
+        print(f"CRITICAL: {e}")
+        startup["errors"].append(str(e))
+    try:
+        load_discovery_documents()
+    except Exception as e:
+        traceback.print_exc()
+        startup["errors"].append(f"Discovery documents: {e}")
+    startup["ready"] = not startup["errors"]
+    startup["started_at"] = time.time()
+    print(f"Startup finished in {startup['started_at'] - started:.2f}s (ready={startup['ready']})")
+    yield
+
+app = FastAPI(title="Google Classroom Downloader API", lifespan=lifespan)
 
 # Add Session Middleware (Secret key should be in env var for prod)
 app.add_middleware(
@@ -53,6 +91,19 @@ app.include_router(auth_router)
 def read_root():
     return {"message": "Google Classroom Downloader API is running"}
 
+@app.get("/healthz")
+def liveness():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readiness():
+    """Readiness: startup loaded config and discovery documents"""
+    if not startup["ready"]:
+        return JSONResponse(status_code=503, content={"status": "starting" if not startup["errors"] else "error",
+                                                      "errors": startup["errors"]})
+    return {"status": "ready", "started_at": startup["started_at"]}
+
 
 @app.get("/courses")
 def get_courses(request: Request):
@@ -60,73 +111,195 @@ def get_courses(request: Request):
     try:
         creds = get_credentials(request)
         print("DEBUG: Credentials retrieved successfully")
-        from backend.core import list_courses
-        return list_courses(creds)
+        # Served from the warm-up when it already fetched them
+        return get_active_courses(request.session["sid"], creds)
     except Exception as e:
-        import traceback
         traceback.print_exc()
         # If not auth, 401
         if "Not authenticated" in str(e):
              raise HTTPException(status_code=401, detail="Not authenticated")
         raise HTTPException(status_code=500, detail=str(e))
 
-from fastapi.responses import FileResponse, JSONResponse
-from pydantic import BaseModel
-from typing import List, Optional
 
 class JobStartRequest(BaseModel):
     courseName: str
     selectedFileIds: Optional[List[str]] = None
+    # Split the archive into parts of at most this many MB (None = single zip)
+    partSizeMb: Optional[int] = Field(None, ge=MIN_PART_SIZE_MB)
+    # Only fetch files that are new or changed since this user's last download of the course
+    delta: bool = False
 
 @app.get("/courses/{course_id}/materials")
 def get_course_materials(course_id: str, request: Request):
     try:
         creds = get_credentials(request)
-        from backend.core import collect_course_materials, get_service
-        # We need services to pass to collect_course_materials
+        # Served from the warm-up when it already fetched them
+        materials = get_materials(request.session["sid"], creds, course_id)
+        return materials
+    except Exception as e:
+        if "Not authenticated" in str(e):
+             raise HTTPException(status_code=401, detail="Not authenticated")
+        print(f"Error fetching materials: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/courses/{course_id}/materials/tree")
+def get_course_material_tree(course_id: str, request: Request):
+    """Top-level posts and their attachments; Drive folders are not expanded"""
+    try:
+        creds = get_credentials(request)
+        classroom_service = get_service(creds, "classroom", "v1")
+        return course_material_tree(classroom_service, course_id)
+    except Exception as e:
+        if "Not authenticated" in str(e):
+             raise HTTPException(status_code=401, detail="Not authenticated")
+        print(f"Error fetching material tree: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/courses/{course_id}/folders/{folder_id}")
+def get_course_folder(course_id: str, folder_id: str, request: Request, path: str = "",
+                      cursor: Optional[str] = None, pageSize: int = 100):
+    """One page of a Drive folder's children. Pass the folder node's path
+    and the returned nextCursor to fetch the following page."""
+    try:
+        creds = get_credentials(request)
+        drive_service = get_service(creds, "drive", "v3")
+        page_size = max(1, min(pageSize, 1000))
+        return drive_folder_page(drive_service, folder_id, path, cursor, page_size)
+    except Exception as e:
+        if "Not authenticated" in str(e):
+             raise HTTPException(status_code=401, detail="Not authenticated")
+        print(f"Error fetching folder: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/courses/{course_id}/changes")
+def get_course_changes(course_id: str, request: Request):
+    """Change feed: files added or changed since the user's last download of the course"""
+    try:
+        creds = get_credentials(request)
+        snapshot = load_snapshot(get_user_id(request), course_id)
         classroom_service = get_service(creds, "classroom", "v1")
         drive_service = get_service(creds, "drive", "v3")
-        
         materials = collect_course_materials(classroom_service, drive_service, course_id)
-        return materials
+        if snapshot is None:
+            return {"since": None, "files": materials}
+        return {"since": snapshot["taken_at"], "files": course_changes(drive_service, materials, snapshot)}
     except Exception as e:
         if "Not authenticated" in str(e):
              raise HTTPException(status_code=401, detail="Not authenticated")
-        print(f"Error fetching materials: {e}")
+        print(f"Error fetching changes: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/courses/{course_id}/materials/stream")
+def stream_course_materials(course_id: str, request: Request):
+    """Full listing as NDJSON, one file per line, written as the course is scanned"""
+    try:
+        creds = get_credentials(request)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    sid = request.session["sid"]
+
+    def generate():
+        try:
+            # Listed by the warm-up; if it is still listing this course, wait for it rather than scan twice
+            cached_materials = warm_materials(sid, course_id)
+            if cached_materials is not None:
+                entries = cached_materials
+            else:
+                classroom_service = get_service(creds, "classroom", "v1")
+                drive_service = get_service(creds, "drive", "v3")
+                entries = iter_course_materials(classroom_service, drive_service, course_id)
+            for entry in entries:
+                yield json.dumps(entry) + "\n"
+        except Exception as e:
+            # Headers are already sent, report the failure in-band
+            print(f"Error streaming materials: {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
 @app.post("/courses/{course_id}/download/start")
 def start_download(course_id: str, job_req: JobStartRequest, request: Request):
     try:
         creds = get_credentials(request)
-        from backend.core import start_zip_job
-        job_id = start_zip_job(creds, course_id, job_req.courseName, job_req.selectedFileIds)
+        job_id = start_zip_job(creds, course_id, job_req.courseName, job_req.selectedFileIds, job_req.partSizeMb,
+                               job_req.delta, get_user_id(request))
         return {"job_id": job_id}
     except Exception as e:
         if "Not authenticated" in str(e):
              raise HTTPException(status_code=401, detail="Not authenticated")
         raise HTTPException(status_code=500, detail=str(e))
 
+def serve_artifact(request: Request, artifact, filename):
+    """Local archives are served here (with Range support); S3 archives are
+    handed off to a presigned URL"""
+    if artifact["kind"] == "local":
+        return archive_response(request, artifact["path"], filename)
+    return RedirectResponse(artifact_store.url(artifact, filename))
+
 @app.get("/download/status/{job_id}")
 def get_job_status(job_id: str):
-    from backend.core import jobs
-    if job_id not in jobs:
+    job = job_store.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    return jobs[job_id]
+    # Artifact references are server paths / bucket keys; clients use the result URLs
+    job.pop("artifact", None)
+    for part in job.get("parts") or []:
+        part.pop("artifact", None)
+    return job
+
+@app.post("/download/cancel/{job_id}")
+def cancel_download(job_id: str):
+    if job_store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # A queued job is cancelled at once; a running one stops at its next
+    # chunk or file and removes its archives
+    status = cancel_job(job_id)
+    if status is None:
+        raise HTTPException(status_code=400, detail="Job already finished")
+    return {"job_id": job_id, "status": status}
 
 @app.get("/download/result/{job_id}")
-def get_job_result(job_id: str):
-    from backend.core import jobs
-    if job_id not in jobs:
+def get_job_result(job_id: str, request: Request):
+    job = job_store.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    job = jobs[job_id]
     if job["status"] != "COMPLETED":
         raise HTTPException(status_code=400, detail="Job not complete")
+
+    # Multi-part jobs: list the parts, each one is fetched separately
+    if len(job.get("parts", [])) > 1:
+        return {
+            "job_id": job_id,
+            "parts": [
+                {
+                    "number": p["number"],
+                    "filename": p["filename"],
+                    "size": p["size"],
+                    "url": f"/download/result/{job_id}/parts/{p['number']}"
+                }
+                for p in job["parts"]
+            ]
+        }
     
-    return FileResponse(
-        job["file_path"],
-        media_type="application/zip",
-        filename=job["filename"]
-    )
+    return serve_artifact(request, job["artifact"], job["filename"])
+
+@app.get("/download/result/{job_id}/parts/{number}")
+def get_job_result_part(job_id: str, number: int, request: Request):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in ("CANCELLED", "FAILED"):
+        raise HTTPException(status_code=400, detail=f"Job {job['status'].lower()}")
+
+    parts = job.get("parts", [])
+    if number < 1 or number > len(parts):
+        raise HTTPException(status_code=404, detail="Part not found")
+
+    # Parts can be fetched while the rest of the job is still running
+    part = parts[number - 1]
+    if part["status"] != "READY":
+        raise HTTPException(status_code=400, detail="Part not ready")
 
+    return serve_artifact(request, part["artifact"], part["filename"])
@@ -0,0 +1,35 @@
+import os
+import hashlib
+from email.utils import formatdate
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+def file_etag(stat_result):
+    """Strong ETag from mtime + size, stable once an archive is finalized.
+    Same value FileResponse sends."""
+    raw = f"{stat_result.st_mtime}-{stat_result.st_size}"
+    return f'"{hashlib.md5(raw.encode()).hexdigest()}"'
+
+def content_disposition(filename):
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+def archive_response(request: Request, path, filename, media_type="application/zip"):
+    """Serve a finished archive. FileResponse handles ETag, Last-Modified,
+    Range (single and multi-range) and If-Range, and can use zero-copy
+    sending (pathsend / sendfile); conditional GETs are answered here."""
+    stat_result = os.stat(path)
+    etag = file_etag(stat_result)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers={
+            "ETag": etag,
+            "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        })
+
+    return FileResponse(path, media_type=media_type, filename=filename, stat_result=stat_result)
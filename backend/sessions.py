@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request as GoogleAuthRequest
+
+# Server-side token storage. The session cookie only carries an opaque id ("sid"),
+# the OAuth tokens live here.
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")  # "memory" or "sqlite"
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(tempfile.gettempdir(), "gcr_sessions.db"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1024"))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(30 * 24 * 3600)))
+
+
+class MemoryTokenStore:
+    """LRU dict of sid -> token data. Lost on restart."""
+
+    def __init__(self, max_entries=SESSION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            data, updated_at = entry
+            if time.time() - updated_at > SESSION_TTL_SECONDS:
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return dict(data)
+
+    def set(self, sid, data):
+        with self._lock:
+            self._data[sid] = (dict(data), time.time())
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class SQLiteTokenStore:
+    """Token data persisted in SQLite so sessions survive restarts."""
+
+    def __init__(self, path=SESSION_DB_PATH):
+        # Refresh tokens are stored here: create the file readable by this user only
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        os.chmod(path, 0o600)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - SESSION_TTL_SECONDS,))
+            self._conn.commit()
+
+    def get(self, sid):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE sid = ? AND updated_at >= ?",
+                (sid, time.time() - SESSION_TTL_SECONDS)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, sid, data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (sid, data, updated_at) VALUES (?, ?, ?)",
+                (sid, json.dumps(data), time.time())
+            )
+            self._conn.commit()
+
+    def delete(self, sid):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+            self._conn.commit()
+
+
+def create_store(kind=SESSION_STORE):
+    if kind == "sqlite":
+        return SQLiteTokenStore()
+    return MemoryTokenStore()
+
+
+token_store = create_store()
+
+# sid -> live Credentials object, shared by requests and background jobs of that user
+_credentials_cache = OrderedDict()
+_credentials_lock = threading.Lock()
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def credentials_to_data(credentials):
+    return {
+        "token": credentials.token,
+        "refresh_token": credentials.refresh_token,
+        "token_uri": credentials.token_uri,
+        "scopes": list(credentials.scopes or []),
+        "expiry": credentials.expiry.isoformat() if credentials.expiry else None
+    }
+
+
+def credentials_from_data(data, client_info):
+    return Credentials(
+        token=data["token"],
+        refresh_token=data.get("refresh_token"),
+        token_uri=data["token_uri"],
+        client_id=client_info["client_id"],
+        client_secret=client_info["client_secret"],
+        scopes=data["scopes"],
+        expiry=datetime.fromisoformat(data["expiry"]) if data.get("expiry") else None
+    )
+
+
+def save_credentials(sid, credentials, user_id=None):
+    """user_id: stable Google account id, keys per-user data such as download
+    snapshots. Kept here, with the tokens, rather than in the cookie."""
+    token_store.set(sid, dict(credentials_to_data(credentials), user_id=user_id))
+    with _credentials_lock:
+        _credentials_cache.pop(sid, None)
+
+
+def get_user_id(sid):
+    data = token_store.get(sid)
+    return data.get("user_id") if data else None
+
+
+def delete_session(sid):
+    token_store.delete(sid)
+    with _credentials_lock:
+        _credentials_cache.pop(sid, None)
+
+
+def load_credentials(sid, client_info):
+    """Return the cached Credentials for this session, refreshing the access
+    token if it has expired. Returns None if the session is unknown."""
+    with _credentials_lock:
+        entry = _credentials_cache.get(sid)
+        if entry is not None:
+            _credentials_cache.move_to_end(sid)
+
+    if entry is None:
+        data = token_store.get(sid)
+        if not data:
+            return None
+        creds = credentials_from_data(data, client_info)
+        with _credentials_lock:
+            # entry = [credentials, token last written to the store, refresh lock]
+            entry = _credentials_cache.setdefault(sid, [creds, data["token"], threading.Lock()])
+            while len(_credentials_cache) > SESSION_CACHE_SIZE:
+                _credentials_cache.popitem(last=False)
+
+    creds, _, refresh_lock = entry
+    # Background jobs hold the same object and the google client refreshes it on 401
+    # by itself; here we refresh proactively and persist whatever token it has now.
+    # The lock makes concurrent requests of one session refresh once, not each.
+    with refresh_lock:
+        if creds.expired and creds.refresh_token:
+            try:
+                creds.refresh(GoogleAuthRequest())
+            except Exception as e:
+                print(f"Token refresh failed for session: {e}")
+        if creds.token != entry[1]:
+            # Keep the rest of the session record (user_id)
+            data = token_store.get(sid) or {}
+            data.update(credentials_to_data(creds))
+            token_store.set(sid, data)
+            entry[1] = creds.token
+    return creds
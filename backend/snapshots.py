@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+
+# Per-user record of what was last downloaded from each course, used for
+# delta ("what's new since last download") archives.
+SNAPSHOT_DB_PATH = os.getenv("SNAPSHOT_DB_PATH", os.path.join(tempfile.gettempdir(), "gcr_snapshots.db"))
+# Give up on the Drive changes feed (and fall back to updateTime) past this many pages
+MAX_CHANGE_PAGES = int(os.getenv("MAX_CHANGE_PAGES", "20"))
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(SNAPSHOT_DB_PATH, check_same_thread=False)
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "user_id TEXT NOT NULL, course_id TEXT NOT NULL, data TEXT NOT NULL, taken_at REAL NOT NULL, "
+            "PRIMARY KEY (user_id, course_id))"
+        )
+        _conn.commit()
+    return _conn
+
+
+def load_snapshot(user_id, course_id):
+    """{"taken_at", "startPageToken", "files": {file_id: {"modifiedTime", "size", "md5Checksum", "path"}}}
+    or None. Every file in the snapshot is known to be current as of startPageToken."""
+    if not user_id:
+        return None
+    with _lock:
+        row = _db().execute(
+            "SELECT data FROM snapshots WHERE user_id = ? AND course_id = ?", (user_id, course_id)
+        ).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def save_snapshot(user_id, course_id, snapshot):
+    snapshot["taken_at"] = time.time()
+    with _lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO snapshots (user_id, course_id, data, taken_at) VALUES (?, ?, ?, ?)",
+            (user_id, course_id, json.dumps(snapshot), snapshot["taken_at"])
+        )
+        _db().commit()
+
+
+def record_download(user_id, course_id, downloaded_files, failed_files=(), start_page_token=None,
+                    covers_course=False):
+    """Merge the files just downloaded (or known to be undownloadable) into
+    the user's snapshot of the course.
+    covers_course: the job looked at every file of the course (no selection),
+    so the whole snapshot is current as of start_page_token."""
+    if not user_id:
+        return
+    snapshot = load_snapshot(user_id, course_id) or {"files": {}}
+    had_files = bool(snapshot["files"])
+    for f in downloaded_files:
+        snapshot["files"][f["id"]] = {
+            "modifiedTime": f.get("modifiedTime"),
+            "size": f.get("size"),
+            "md5Checksum": f.get("md5Checksum"),
+            "path": f["path"]
+        }
+    # Failed files are changed and not saved: forget them so the next delta retries them
+    for f in failed_files:
+        snapshot["files"].pop(f["id"], None)
+    # Files outside a selection are only known as of the older token, which
+    # must stay so their later edits still show up in the changes feed
+    if covers_course or not had_files:
+        snapshot["startPageToken"] = start_page_token
+    save_snapshot(user_id, course_id, snapshot)
+
+
+def get_start_page_token(drive_service):
+    try:
+        return drive_service.changes().getStartPageToken().execute().get("startPageToken")
+    except Exception as e:
+        print(f"Drive changes feed unavailable: {e}")
+        return None
+
+
+def drive_changed_ids(drive_service, page_token):
+    """IDs of Drive files changed since page_token, or None when the feed
+    can't be used (no token, error, or too many changes to be worth it)"""
+    if not page_token:
+        return None
+    changed = set()
+    try:
+        for _ in range(MAX_CHANGE_PAGES):
+            resp = drive_service.changes().list(
+                pageToken=page_token,
+                fields="nextPageToken, newStartPageToken, changes(fileId)",
+                pageSize=1000,
+                includeItemsFromAllDrives=True,
+                supportsAllDrives=True
+            ).execute()
+            changed.update(c["fileId"] for c in resp.get("changes", []) if c.get("fileId"))
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                return changed
+    except Exception as e:
+        print(f"Could not read Drive changes: {e}")
+    return None
+
+
+def reuse_known_metadata(files, snapshot, changed_ids):
+    """Fill metadata of Classroom attachments from the snapshot when the
+    changes feed shows them unchanged, saving a files().get per attachment.
+    Without the feed nothing is reused: editing a Drive file does not touch
+    the Classroom post it is attached to."""
+    if changed_ids is None:
+        return
+    for f in files:
+        known = snapshot["files"].get(f["id"])
+        if known is None or f.get("modifiedTime") is not None:
+            continue
+        if f["id"] not in changed_ids:
+            f["modifiedTime"] = known["modifiedTime"]
+            f["size"] = known["size"]
+            f["md5Checksum"] = known["md5Checksum"]
+
+
+def new_or_changed(files, snapshot):
+    """Files that are not in the snapshot or whose modifiedTime moved"""
+    result = []
+    for f in files:
+        known = snapshot["files"].get(f["id"])
+        if known is None or f.get("modifiedTime") is None or known.get("modifiedTime") != f.get("modifiedTime"):
+            result.append(f)
+    return result
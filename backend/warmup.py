@@ -0,0 +1,113 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from backend.core import get_service, list_courses, collect_course_materials
+
+# Optional prefetch of course listings right after login
+WARM_START = os.getenv("WARM_START", "0") == "1"
+WARM_START_COURSES = int(os.getenv("WARM_START_COURSES", "5"))
+WARM_START_WORKERS = int(os.getenv("WARM_START_WORKERS", "4"))
+LISTING_CACHE_TTL = int(os.getenv("LISTING_CACHE_TTL", "300"))
+LISTING_CACHE_SIZE = int(os.getenv("LISTING_CACHE_SIZE", "512"))
+
+# Warm-up results: (sid, kind, ...) -> (expires_at, Future). A Future so that a
+# request arriving while the warm-up is still fetching waits for it instead of listing again.
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def cached(key, compute):
+    now = time.time()
+    with _lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            _cache.move_to_end(key)
+            future, owner = entry[1], False
+        else:
+            future, owner = Future(), True
+            _cache[key] = (now + LISTING_CACHE_TTL, future)
+            while len(_cache) > LISTING_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    if owner:
+        try:
+            future.set_result(compute())
+        except Exception as e:
+            # Don't cache failures
+            with _lock:
+                if _cache.get(key, (None, None))[1] is future:
+                    del _cache[key]
+            future.set_exception(e)
+    return future.result()
+
+
+def _take(key):
+    """Warm-up result for key, removed from the cache so the next request
+    fetches fresh data; waits if the warm-up is still fetching it. None if
+    the warm-up didn't fetch it or failed."""
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None or entry[0] <= time.time():
+            return None
+        del _cache[key]
+    try:
+        return entry[1].result()
+    except Exception:
+        return None
+
+
+def invalidate(sid):
+    with _lock:
+        for key in [k for k in _cache if k[0] == sid]:
+            del _cache[key]
+
+
+# Only warm-up results are cached, and each is served once; without
+# WARM_START every request lists live data.
+
+def get_active_courses(sid, creds):
+    """Active courses of the user, from the warm-up if it fetched them"""
+    courses = _take((sid, "courses"))
+    if courses is None:
+        return list_courses(creds)
+    # The warm-up lists every state
+    return [c for c in courses if c["courseState"] == "ACTIVE"]
+
+
+def list_materials(creds, course_id):
+    classroom_service = get_service(creds, "classroom", "v1")
+    drive_service = get_service(creds, "drive", "v3")
+    return collect_course_materials(classroom_service, drive_service, course_id)
+
+
+def warm_materials(sid, course_id):
+    """Materials listed by the warm-up, waiting for it if it is still
+    listing them; None if the warm-up didn't list this course"""
+    return _take((sid, "materials", course_id))
+
+
+def get_materials(sid, creds, course_id):
+    materials = warm_materials(sid, course_id)
+    return materials if materials is not None else list_materials(creds, course_id)
+
+
+def warm_up(sid, creds):
+    try:
+        courses = cached((sid, "courses"), lambda: list_courses(creds, course_states=None))
+        active = [c for c in courses if c["courseState"] == "ACTIVE"]
+        recent = sorted(active, key=lambda c: c.get("updateTime") or "", reverse=True)[:WARM_START_COURSES]
+        # Each worker builds its own services inside list_materials
+        with ThreadPoolExecutor(max_workers=WARM_START_WORKERS) as pool:
+            list(pool.map(lambda c: cached((sid, "materials", c["id"]), lambda: list_materials(creds, c["id"])),
+                          recent))
+        print(f"Warm-up done: {len(courses)} courses, {len(recent)} material listings")
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+
+
+def start_warm_up(sid, creds):
+    if WARM_START:
+        threading.Thread(target=warm_up, args=(sid, creds), daemon=True).start()
@@ -0,0 +1,71 @@
+"""
+Job worker for scaled-out deployments.
+
+Run with JOB_QUEUE=sqlite or JOB_QUEUE=redis (and the matching JOB_STORE /
+ARTIFACT_STORE) on as many machines as needed:
+
+    python -m backend.worker
+
+API nodes then only enqueue jobs and read their state.
+"""
+from backend import config  # loads .env before other backend modules read settings
+import time
+import threading
+import traceback
+
+from backend.core import job_queue, job_gate, run_job, load_discovery_documents, JOB_QUEUE_IS_LOCAL, \
+    MAX_CONCURRENT_JOBS
+from backend.backends import QUEUE_LEASE_SECONDS
+
+
+def keep_lease(job_id, done):
+    while not done.wait(QUEUE_LEASE_SECONDS / 3):
+        try:
+            job_queue.heartbeat(job_id)
+        except Exception as e:
+            print(f"Could not renew the lease of job {job_id}: {e}")
+
+
+def run_claimed(payload):
+    job_id = payload["job_id"]
+    print(f"Running job {job_id} (priority {payload.get('priority', 1)})")
+    # Renew the lease while the job runs; if this worker dies the job is claimed again
+    done = threading.Event()
+    threading.Thread(target=keep_lease, args=(job_id, done), daemon=True).start()
+    try:
+        run_job(payload)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        done.set()
+        # Removes the queue entry, and with it the user's tokens
+        job_queue.ack(job_id)
+
+
+def claim_loop():
+    """Claim jobs in priority order. MAX_CONCURRENT_JOBS of them run at once
+    (job_gate in run_job); one more may be claimed and wait for a slot, and
+    if it is more urgent a running job yields to it at its next file."""
+    print(f"Worker waiting for jobs ({MAX_CONCURRENT_JOBS} at a time)")
+    while True:
+        if job_gate.waiting_count() > 0:
+            time.sleep(0.5)
+            continue
+        payload = job_queue.claim()
+        if payload is None:
+            continue
+        threading.Thread(target=run_claimed, args=(payload,), daemon=True).start()
+        # Let the job reach the gate before deciding whether to claim another
+        time.sleep(0.1)
+
+
+def main():
+    if JOB_QUEUE_IS_LOCAL:
+        raise SystemExit("JOB_QUEUE is 'local': jobs run inside the API process. Set JOB_QUEUE=sqlite or redis.")
+    config.load_config()
+    load_discovery_documents()
+    claim_loop()
+
+
+if __name__ == "__main__":
+    main()
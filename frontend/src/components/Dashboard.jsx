@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import axios from 'axios';
 import FileSelector from './FileSelector';
 import PixelCard from './PixelCard';
@@ -14,7 +14,10 @@ const Dashboard = () => {
     // State for File Selection
     const [selectingCourse, setSelectingCourse] = useState(null); // { id, name }
     const [filesToSelect, setFilesToSelect] = useState(null); // Array of file objects
+    const [materialTree, setMaterialTree] = useState(null); // Posts with their attachments, folders unexpanded; false if it failed
     const [loadingMaterials, setLoadingMaterials] = useState(false);
+    // Aborts the materials requests of the course currently in the selector
+    const materialsAbort = useRef(null);
 
     // State for Download Job
     const [downloadJob, setDownloadJob] = useState(null); // { id, courseName, progress, status, message }
@@ -25,7 +28,7 @@ const Dashboard = () => {
 
     useEffect(() => {
         let interval;
-        if (downloadJob && downloadJob.status !== 'COMPLETED' && downloadJob.status !== 'FAILED') {
+        if (downloadJob && downloadJob.id && !['COMPLETED', 'FAILED', 'CANCELLED'].includes(downloadJob.status)) {
             interval = setInterval(async () => {
                 try {
                     const res = await axios.get(`${API_URL}/download/status/${downloadJob.id}`, {
@@ -33,12 +36,16 @@ const Dashboard = () => {
                     });
                     setDownloadJob(prev => ({ ...prev, ...res.data }));
 
-                    if (res.data.status === 'COMPLETED') {
+                    const isMultiPart = res.data.parts && res.data.parts.length > 1;
+                    if (res.data.status === 'COMPLETED' && isMultiPart) {
+                        // Multi-part: keep the modal open, user fetches each part from the list
+                        clearInterval(interval);
+                    } else if (res.data.status === 'COMPLETED') {
                         // Trigger file download
                         window.location.href = `${API_URL}/download/result/${downloadJob.id}`;
                         clearInterval(interval);
                         setTimeout(() => setDownloadJob(null), 2000); // Close modal 2s after complete
-                    } else if (res.data.status === 'FAILED') {
+                    } else if (res.data.status === 'FAILED' || res.data.status === 'CANCELLED') {
                         clearInterval(interval);
                     }
                 } catch (err) {
@@ -67,25 +74,72 @@ const Dashboard = () => {
         }
     };
 
+    const stopLoadingMaterials = () => {
+        if (materialsAbort.current) materialsAbort.current.abort();
+        materialsAbort.current = null;
+    };
+
+    const closeSelector = () => {
+        stopLoadingMaterials();
+        setSelectingCourse(null);
+        setFilesToSelect(null);
+        setMaterialTree(null);
+    };
+
     const onDownloadClick = async (courseId, courseName) => {
-        // 1. Fetch materials first
+        // A previous course's requests must not keep filling this selector
+        stopLoadingMaterials();
+        const controller = new AbortController();
+        materialsAbort.current = controller;
+
         setLoadingMaterials(true);
+        setFilesToSelect([]);
+        setMaterialTree(null);
+        setSelectingCourse({ id: courseId, name: courseName });
+
+        // Post/folder tree renders first; folders are expanded on demand by the selector
+        axios.get(`${API_URL}/courses/${courseId}/materials/tree`, { withCredentials: true, signal: controller.signal })
+            .then(res => { if (!controller.signal.aborted) setMaterialTree(res.data); })
+            .catch(err => {
+                if (axios.isCancel(err)) return;
+                console.error("Failed to load material tree", err);
+                setMaterialTree(false);
+            });
+
+        // Full listing streamed as NDJSON, needed for the by-type view and the selection
         try {
-            const res = await axios.get(`${API_URL}/courses/${courseId}/materials`, { withCredentials: true });
-            setFilesToSelect(res.data);
-            setSelectingCourse({ id: courseId, name: courseName });
+            const res = await fetch(`${API_URL}/courses/${courseId}/materials/stream`, { credentials: 'include', signal: controller.signal });
+            if (!res.ok) throw new Error(`HTTP ${res.status}`);
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffered = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffered += decoder.decode(value, { stream: true });
+                const lines = buffered.split('\n');
+                buffered = lines.pop();
+                const batch = lines.filter(Boolean).map(line => JSON.parse(line));
+                const failed = batch.find(entry => entry.error);
+                if (failed) throw new Error(failed.error);
+                if (batch.length) setFilesToSelect(prev => prev && [...prev, ...batch]);
+            }
         } catch (err) {
+            if (controller.signal.aborted) return;
             console.error("Failed to load materials", err);
             alert("Failed to load course materials");
+            closeSelector();
         } finally {
-            setLoadingMaterials(false);
+            if (materialsAbort.current === controller) {
+                materialsAbort.current = null;
+                setLoadingMaterials(false);
+            }
         }
     };
 
     const handleConfirmSelection = async (selectedIds) => {
         const { id, name } = selectingCourse;
-        setSelectingCourse(null);
-        setFilesToSelect(null);
+        closeSelector();
 
         // Start download job
         try {
@@ -101,6 +155,18 @@ const Dashboard = () => {
         }
     };
 
+    const handleCancelDownload = async () => {
+        const jobId = downloadJob?.id;
+        setDownloadJob(null);
+        if (!jobId) return;
+        try {
+            await axios.post(`${API_URL}/download/cancel/${jobId}`, {}, { withCredentials: true });
+        } catch (err) {
+            // Already finished or gone; nothing left to stop
+            console.error("Cancel failed", err);
+        }
+    };
+
     const handleLogout = async () => {
         try {
             await axios.get(`${API_URL}/auth/logout`, { withCredentials: true });
@@ -164,9 +230,13 @@ const Dashboard = () => {
             {/* File Selector Modal */}
             {selectingCourse && filesToSelect && (
                 <FileSelector
+                    courseId={selectingCourse.id}
+                    apiUrl={API_URL}
                     files={filesToSelect}
+                    tree={materialTree}
+                    loading={loadingMaterials}
                     onConfirm={handleConfirmSelection}
-                    onCancel={() => { setSelectingCourse(null); setFilesToSelect(null); }}
+                    onCancel={() => { closeSelector(); setLoadingMaterials(false); }}
                 />
             )}
 
@@ -185,10 +255,34 @@ const Dashboard = () => {
                                 </div>
                                 <p className="modal-message">{downloadJob.message}</p>
                                 <p>{downloadJob.progress}%</p>
+                                {downloadJob.parts && downloadJob.parts.length > 1 && (
+                                    <div style={{ textAlign: 'left', fontSize: '0.6rem' }}>
+                                        {downloadJob.parts.map(part => (
+                                            <div key={part.number}>
+                                                {part.status === 'READY' ? (
+                                                    <a href={`${API_URL}/download/result/${downloadJob.id}/parts/${part.number}`} style={{ color: '#9ECE6A' }}>
+                                                        {part.filename}
+                                                    </a>
+                                                ) : (
+                                                    <span style={{ opacity: 0.6 }}>{part.filename} (writing...)</span>
+                                                )}
+                                            </div>
+                                        ))}
+                                    </div>
+                                )}
                             </>
                         )}
 
-                        {(downloadJob.status === 'COMPLETED' || downloadJob.status === 'FAILED') && (
+                        {(downloadJob.status === 'QUEUED' || downloadJob.status === 'PROCESSING') && (
+                            <button
+                                onClick={handleCancelDownload}
+                                style={{ marginTop: '16px', padding: '8px 16px', cursor: 'pointer', backgroundColor: 'transparent', color: '#F7768E', border: '2px solid #F7768E', fontFamily: "'Press Start 2P', monospace", boxShadow: '2px 2px 0px 0px #F7768E', borderRadius: 0 }}
+                            >
+                                Cancel
+                            </button>
+                        )}
+
+                        {['COMPLETED', 'FAILED', 'CANCELLED'].includes(downloadJob.status) && (
                             <button
                                 onClick={() => setDownloadJob(null)}
                                 style={{ marginTop: '16px', padding: '8px 16px', cursor: 'pointer', backgroundColor: 'transparent', color: '#9ECE6A', border: '2px solid #9ECE6A', fontFamily: "'Press Start 2P', monospace", boxShadow: '2px 2px 0px 0px #9ECE6A', borderRadius: 0 }}
@@ -1,7 +1,83 @@
-import React, { useState, useEffect, useMemo } from 'react';
+import React, { useState, useMemo } from 'react';
+import axios from 'axios';
 
-const FileSelector = ({ files, onConfirm, onCancel }) => {
-    const [selectedIds, setSelectedIds] = useState(new Set(files.map(f => f.id)));
+const linkButtonStyle = { background: 'transparent', border: 'none', color: '#9ECE6A', cursor: 'pointer', padding: 0, fontSize: '0.6rem', fontFamily: 'inherit', textAlign: 'left' };
+
+const FileRow = ({ file, checked, onToggle }) => (
+    <div style={{ display: 'flex', alignItems: 'center', fontSize: '0.6rem', color: '#9ECE6A' }}>
+        <input
+            type="checkbox"
+            checked={checked}
+            onChange={() => onToggle(file.id)}
+            style={{ marginRight: '8px', accentColor: '#9ECE6A' }}
+        />
+        <span title={file.path} style={{ whiteSpace: 'nowrap', overflow: 'hidden', textOverflow: 'ellipsis' }}>
+            {file.name}
+        </span>
+    </div>
+);
+
+// A Drive folder of the tree view; its children are fetched a page at a time when opened
+const FolderNode = ({ folder, courseId, apiUrl, isSelected, onToggle }) => {
+    const [open, setOpen] = useState(false);
+    const [items, setItems] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loaded, setLoaded] = useState(false);
+    const [loadingPage, setLoadingPage] = useState(false);
+
+    const loadPage = async (cursor) => {
+        setLoadingPage(true);
+        try {
+            const res = await axios.get(`${apiUrl}/courses/${courseId}/folders/${folder.id}`, {
+                params: { path: folder.path, cursor: cursor || undefined },
+                withCredentials: true
+            });
+            setItems(prev => [...prev, ...res.data.items]);
+            setNextCursor(res.data.nextCursor);
+            setLoaded(true);
+        } catch (err) {
+            console.error("Failed to load folder", err);
+        } finally {
+            setLoadingPage(false);
+        }
+    };
+
+    const toggleOpen = () => {
+        if (!open && !loaded && !loadingPage) loadPage(null);
+        setOpen(!open);
+    };
+
+    return (
+        <div style={{ fontSize: '0.6rem', color: '#9ECE6A' }}>
+            <button onClick={toggleOpen} style={linkButtonStyle}>
+                {open ? '▾' : '▸'} {folder.name}/
+            </button>
+            {open && (
+                <div style={{ paddingLeft: '20px', marginTop: '6px', display: 'grid', gridTemplateColumns: '1fr', gap: '6px' }}>
+                    {items.map(item => item.isFolder ? (
+                        <FolderNode key={item.id} folder={item} courseId={courseId} apiUrl={apiUrl} isSelected={isSelected} onToggle={onToggle} />
+                    ) : (
+                        <FileRow key={item.id} file={item} checked={isSelected(item.id)} onToggle={onToggle} />
+                    ))}
+                    {loadingPage && <span style={{ opacity: 0.6 }}>Loading...</span>}
+                    {!loadingPage && nextCursor && (
+                        <button onClick={() => loadPage(nextCursor)} style={linkButtonStyle}>Load more...</button>
+                    )}
+                </div>
+            )}
+        </div>
+    );
+};
+
+const FileSelector = ({ courseId, apiUrl, files, tree = null, loading = false, onConfirm, onCancel }) => {
+    // Track what the user unticked, so files that stream in later start selected
+    const [deselectedIds, setDeselectedIds] = useState(new Set());
+    // "type": streamed files grouped by kind; "post": the course's posts, folders opened on demand
+    const [view, setView] = useState('post');
+    const selectedIds = useMemo(
+        () => new Set(files.filter(f => !deselectedIds.has(f.id)).map(f => f.id)),
+        [files, deselectedIds]
+    );
 
     // Group files by type
     const groupedFiles = useMemo(() => {
@@ -22,30 +98,66 @@ const FileSelector = ({ files, onConfirm, onCancel }) => {
     }, [files]);
 
     const toggleFile = (id) => {
-        const newSelected = new Set(selectedIds);
-        if (newSelected.has(id)) newSelected.delete(id);
-        else newSelected.add(id);
-        setSelectedIds(newSelected);
+        const newDeselected = new Set(deselectedIds);
+        if (newDeselected.has(id)) newDeselected.delete(id);
+        else newDeselected.add(id);
+        setDeselectedIds(newDeselected);
     };
 
     const toggleGroup = (type) => {
         const groupFiles = groupedFiles[type];
         const allSelected = groupFiles.every(f => selectedIds.has(f.id));
-        const newSelected = new Set(selectedIds);
+        const newDeselected = new Set(deselectedIds);
 
         groupFiles.forEach(f => {
-            if (allSelected) newSelected.delete(f.id);
-            else newSelected.add(f.id);
+            if (allSelected) newDeselected.add(f.id);
+            else newDeselected.delete(f.id);
         });
-        setSelectedIds(newSelected);
+        setDeselectedIds(newDeselected);
     };
 
     return (
         <div className="modal-overlay">
             <div className="modal-content" style={{ maxWidth: '800px', textAlign: 'left', maxHeight: '90vh', overflowY: 'auto', backgroundColor: 'rgba(0, 0, 0, 0.8)', backdropFilter: 'blur(5px)', border: '4px solid #9ECE6A' }}>
                 <h2 style={{ marginTop: 0, color: '#9ECE6A' }}>Select Files to Download</h2>
+                {loading && <p style={{ color: '#9ECE6A', fontSize: '0.6rem' }}>Scanning course... ({files.length} files found so far)</p>}
+
+                <div style={{ display: 'flex', gap: '16px', marginBottom: '16px' }}>
+                    {[['post', 'By post'], ['type', 'By type']].map(([key, label]) => (
+                        <button
+                            key={key}
+                            onClick={() => setView(key)}
+                            style={{ ...linkButtonStyle, textDecoration: view === key ? 'underline' : 'none' }}
+                        >
+                            {label}
+                        </button>
+                    ))}
+                </div>
+
+                {view === 'post' && tree === null && <p style={{ color: '#9ECE6A', fontSize: '0.6rem' }}>Loading posts...</p>}
+                {view === 'post' && tree === false && <p style={{ color: '#9ECE6A', fontSize: '0.6rem' }}>Could not load posts, use "By type".</p>}
+
+                {view === 'post' && tree && tree.map(post => (
+                    <div key={post.id} style={{ marginBottom: '20px' }}>
+                        <h4 style={{ margin: 0, padding: '8px', color: '#9ECE6A', fontSize: '0.8rem' }}>{post.title}</h4>
+                        <div style={{ paddingLeft: '20px', marginTop: '8px', display: 'grid', gridTemplateColumns: '1fr', gap: '8px' }}>
+                            {post.items.map(item => item.isFolder ? (
+                                <FolderNode
+                                    key={item.id}
+                                    folder={item}
+                                    courseId={courseId}
+                                    apiUrl={apiUrl}
+                                    isSelected={id => !deselectedIds.has(id)}
+                                    onToggle={toggleFile}
+                                />
+                            ) : (
+                                <FileRow key={item.id} file={item} checked={!deselectedIds.has(item.id)} onToggle={toggleFile} />
+                            ))}
+                        </div>
+                    </div>
+                ))}
 
-                {Object.entries(groupedFiles).map(([type, groupFiles]) => {
+                {view === 'type' && Object.entries(groupedFiles).map(([type, groupFiles]) => {
                     const allSelected = groupFiles.every(f => selectedIds.has(f.id));
                     const indeterminate = !allSelected && groupFiles.some(f => selectedIds.has(f.id));
 
@@ -63,17 +175,7 @@ const FileSelector = ({ files, onConfirm, onCancel }) => {
                             </div>
                             <div style={{ paddingLeft: '20px', marginTop: '8px', display: 'grid', gridTemplateColumns: '1fr', gap: '8px' }}>
                                 {groupFiles.map(f => (
-                                    <div key={f.id} style={{ display: 'flex', alignItems: 'center', fontSize: '0.6rem', color: '#9ECE6A' }}>
-                                        <input
-                                            type="checkbox"
-                                            checked={selectedIds.has(f.id)}
-                                            onChange={() => toggleFile(f.id)}
-                                            style={{ marginRight: '8px', accentColor: '#9ECE6A' }}
-                                        />
-                                        <span title={f.path} style={{ whiteSpace: 'nowrap', overflow: 'hidden', textOverflow: 'ellipsis' }}>
-                                            {f.name}
-                                        </span>
-                                    </div>
+                                    <FileRow key={f.id} file={f} checked={selectedIds.has(f.id)} onToggle={toggleFile} />
                                 ))}
                             </div>
                         </div>
@@ -86,6 +188,7 @@ const FileSelector = ({ files, onConfirm, onCancel }) => {
                     </button>
                     <button
                         onClick={() => onConfirm(Array.from(selectedIds))}
+                        disabled={loading}
                         style={{ padding: '8px 16px', background: 'transparent', color: '#9ECE6A', border: '1px solid #9ECE6A', borderRadius: '4px', cursor: 'pointer' }}
                     >
                         Download Selected ({selectedIds.size})
@@ -204,41 +204,58 @@ def download_drive_file(file_id, file_path, drive_service, total_files=None, cur
     print(f"Downloaded: {file_path}", flush=True)
 
 
-def download_from_drive_folder(drive_service, folder_id, out_dir, total_files, current_index):
-    os.makedirs(out_dir, exist_ok=True)
+FOLDER_MIME = "application/vnd.google-apps.folder"
+DRIVE_PAGE_SIZE = 1000
+
+
+def iter_drive_folder_pages(drive_service, folder_id):
+    """Yield every child of a Drive folder, following nextPageToken"""
     query = f"'{folder_id}' in parents and trashed = false"
+    page_token = None
     while True:
-        resp = drive_service.files().list(q=query, fields="nextPageToken, files(id, name, mimeType)").execute()
-        files = resp.get("files", [])
-        for f in files:
-            if f.get("mimeType") == "application/vnd.google-apps.folder":
-                subdir = os.path.join(out_dir, safe_name(f.get("name", f["id"])))
-                current_index = download_from_drive_folder(drive_service, f["id"], subdir, total_files, current_index)
-            else:
-                dest = os.path.join(out_dir, safe_name(f.get("name", f["id"])))
-                download_drive_file(f["id"], dest, drive_service, total_files, current_index)
-                current_index += 1
+        resp = drive_service.files().list(
+            q=query,
+            fields="nextPageToken, files(id, name, mimeType)",
+            pageSize=DRIVE_PAGE_SIZE,
+            pageToken=page_token
+        ).execute()
+        for f in resp.get("files", []):
+            yield f
         page_token = resp.get("nextPageToken")
         if not page_token:
             break
+
+
+def walk_drive_folder(drive_service, folder_id, out_dir):
+    """Iterative depth-first walk of a Drive folder tree.
+    Yields (item, parent_dir) for every file and subfolder; no recursion, so
+    deep trees can't hit the recursion limit."""
+    stack = [(folder_id, out_dir)]
+    while stack:
+        current_id, current_dir = stack.pop()
+        subfolders = []
+        for f in iter_drive_folder_pages(drive_service, current_id):
+            yield f, current_dir
+            if f.get("mimeType") == FOLDER_MIME:
+                subfolders.append((f["id"], os.path.join(current_dir, safe_name(f.get("name", f["id"])))))
+        # Reversed so subfolders are visited in listing order
+        stack.extend(reversed(subfolders))
+
+
+def download_from_drive_folder(drive_service, folder_id, out_dir, total_files, current_index):
+    os.makedirs(out_dir, exist_ok=True)
+    for f, parent_dir in walk_drive_folder(drive_service, folder_id, out_dir):
+        if f.get("mimeType") == FOLDER_MIME:
+            os.makedirs(os.path.join(parent_dir, safe_name(f.get("name", f["id"]))), exist_ok=True)
+        else:
+            dest = os.path.join(parent_dir, safe_name(f.get("name", f["id"])))
+            download_drive_file(f["id"], dest, drive_service, total_files, current_index)
+            current_index += 1
     return current_index
 
 
 def count_files_in_drive_folder(drive_service, folder_id):
-    query = f"'{folder_id}' in parents and trashed = false"
-    total = 0
-    while True:
-        resp = drive_service.files().list(q=query, fields="nextPageToken, files(id, mimeType)").execute()
-        files = resp.get("files", [])
-        for f in files:
-            if f.get("mimeType") == "application/vnd.google-apps.folder":
-                total += count_files_in_drive_folder(drive_service, f["id"])
-            else:
-                total += 1
-        page_token = resp.get("nextPageToken")
-        if not page_token:
-            break
-    return total
+    return sum(1 for f, _ in walk_drive_folder(drive_service, folder_id, "") if f.get("mimeType") != FOLDER_MIME)
 
 
 def count_total_files(classroom_service, drive_service, course_id):
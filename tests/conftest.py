@@ -0,0 +1,25 @@
+import os
+import tempfile
+
+import pytest
+
+# Keep job state in memory and archives in a scratch directory; set before backend.core is imported
+os.environ.setdefault("JOB_STORE", "memory")
+os.environ.setdefault("ARTIFACT_DIR", tempfile.mkdtemp(prefix="gcr_test_"))
+
+
+@pytest.fixture
+def fake_google(monkeypatch):
+    """Patch core to use fake services; returns a function that sets up the course files"""
+    from backend import core
+    from tests.fakes import FakeClassroom, FakeDownload, FakeDrive
+
+    def setup(files, fail_ids=(), delay=0.0):
+        drive = FakeDrive("folder", files, fail_ids, delay)
+        classroom = FakeClassroom("folder")
+        FakeDownload.drive = drive
+        monkeypatch.setattr(core, "MediaIoBaseDownload", FakeDownload)
+        monkeypatch.setattr(core, "get_service", lambda creds, name, version: classroom if name == "classroom" else drive)
+        return drive
+
+    return setup
@@ -0,0 +1,103 @@
+"""Stand-ins for the Classroom and Drive clients used by the job tests"""
+import random
+import time
+
+from backend.core import FOLDER_MIME
+
+
+class _Request:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+
+class _PostListing:
+    def __init__(self, key, posts):
+        self.key = key
+        self.posts = posts
+
+    def list(self, courseId=None, pageToken=None):
+        return _Request({self.key: self.posts})
+
+
+class FakeClassroom:
+    """One announcement with a Drive folder attachment"""
+
+    def __init__(self, folder_id):
+        self.folder_id = folder_id
+
+    def courses(self):
+        return self
+
+    def announcements(self):
+        attachment = {"id": self.folder_id, "title": "Folder", "mimeType": FOLDER_MIME}
+        return _PostListing("announcements", [{"id": "p1", "title": "Files", "materials": [
+            {"driveFile": {"driveFile": attachment}}
+        ]}])
+
+    def courseWorkMaterials(self):
+        return _PostListing("courseWorkMaterial", [])
+
+    def courseWork(self):
+        return _PostListing("courseWork", [])
+
+
+class FakeDrive:
+    """A flat folder of files whose content is derived from their id"""
+
+    def __init__(self, folder_id, files, fail_ids=(), delay=0.0):
+        self.folder_id = folder_id
+        self.listing = files
+        self.fail_ids = set(fail_ids)
+        self.delay = delay
+        # Called with the file id before each download, for tests that act mid-job
+        self.on_download = None
+
+    def files(self):
+        return self
+
+    def list(self, q, **kw):
+        return _Request({"files": self.listing})
+
+    def get_media(self, fileId):
+        return fileId
+
+
+def file_content(file_id, size):
+    rnd = random.Random(file_id)
+    block = bytes(rnd.getrandbits(8) for _ in range(64)) + b"-" * 64
+    return (block * (size // len(block) + 1))[:size]
+
+
+class FakeDownload:
+    """Stands in for MediaIoBaseDownload: delivers file_content of the id in two chunks"""
+    drive = None
+
+    def __init__(self, fh, file_id, chunksize=None):
+        self.fh = fh
+        self.file_id = file_id
+        self.chunks = 2
+
+    def next_chunk(self):
+        drive = FakeDownload.drive
+        if drive.delay:
+            time.sleep(random.random() * drive.delay)
+        if drive.on_download and self.chunks == 2:
+            drive.on_download(self.file_id)
+        if self.file_id in drive.fail_ids:
+            raise IOError("download failed")
+        size = next(int(f["size"]) for f in drive.listing if f["id"] == self.file_id)
+        data = file_content(self.file_id, size)
+        half = len(data) // 2
+        self.fh.write(data[:half] if self.chunks == 2 else data[half:])
+        self.chunks -= 1
+        return None, self.chunks == 0
+
+
+def make_files(count, mime="text/plain"):
+    return [
+        {"id": f"f{i}", "name": f"file{i:03d}.txt", "mimeType": mime, "size": str(1000 + i * 731), "modifiedTime": "t0"}
+        for i in range(count)
+    ]
@@ -0,0 +1,155 @@
+import io
+import os
+import threading
+import zipfile
+
+from backend import core
+from tests.fakes import file_content, make_files
+
+
+def write_members(members, precompressed=True):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
+        for name, data, mime in members:
+            if precompressed:
+                zinfo, payload = core.deflate_entry(name, io.BytesIO(data), mime)
+                core.write_precompressed(zip_file, zinfo, payload)
+            else:
+                core.write_member(zip_file, name, io.BytesIO(data), mime)
+    buf.seek(0)
+    return zipfile.ZipFile(buf)
+
+
+MEMBERS = [
+    ("notes/a.txt", b"lecture notes " * 5000, "text/plain"),
+    ("video/b.mp4", os.urandom(4096), "video/mp4"),
+    ("random.bin", os.urandom(4096), "application/octet-stream"),
+    ("empty.txt", b"", "text/plain"),
+]
+
+
+def test_precompressed_writes_supported_on_this_python():
+    # write_precompressed uses ZipFile internals; this fails first when they change
+    assert core.PRECOMPRESSED_WRITES
+
+
+def test_precompressed_members_read_back_in_order():
+    zip_file = write_members(MEMBERS)
+    assert zip_file.testzip() is None
+    assert zip_file.namelist() == [name for name, _, _ in MEMBERS]
+    for name, data, _ in MEMBERS:
+        assert zip_file.read(name) == data
+
+
+def test_compress_type_per_member():
+    zip_file = write_members(MEMBERS)
+    assert zip_file.getinfo("notes/a.txt").compress_type == zipfile.ZIP_DEFLATED
+    # Media is stored, and so is data that deflate would make bigger
+    assert zip_file.getinfo("video/b.mp4").compress_type == zipfile.ZIP_STORED
+    assert zip_file.getinfo("random.bin").compress_type == zipfile.ZIP_STORED
+
+
+def test_members_spilled_to_disk(monkeypatch):
+    monkeypatch.setattr(core, "SPOOL_MAX_BYTES", 1024)
+    zip_file = write_members(MEMBERS)
+    assert zip_file.testzip() is None
+    assert zip_file.read("notes/a.txt") == MEMBERS[0][1]
+
+
+def test_fallback_writes_same_content():
+    zip_file = write_members(MEMBERS, precompressed=False)
+    assert zip_file.testzip() is None
+    assert zip_file.namelist() == [name for name, _, _ in MEMBERS]
+    for name, data, _ in MEMBERS:
+        assert zip_file.read(name) == data
+
+
+def test_plan_parts_first_fit_decreasing():
+    files = [{"id": str(size), "size": size} for size in (70, 50, 40, 30, 10)]
+    parts = core.plan_parts(files, 100)
+    assert [[f["size"] for f in part] for part in parts] == [[70, 30], [50, 40, 10]]
+    assert core.plan_parts(files) == [files]
+
+
+def run_job(job_id, **kwargs):
+    core.job_store.create(job_id, {"status": "QUEUED"})
+    core.background_zip_task(None, "course", job_id, "Course", **kwargs)
+    return core.job_store.get(job_id)
+
+
+def run_job_with_timeout(job_id, timeout=10, **kwargs):
+    thread = threading.Thread(target=run_job, args=(job_id,), kwargs=kwargs, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "job hung"
+    return core.job_store.get(job_id)
+
+
+def test_job_writes_members_in_manifest_order(fake_google, monkeypatch):
+    monkeypatch.setattr(core, "SPOOL_MAX_BYTES", 4096)
+    monkeypatch.setattr(core, "COMPRESS_WORKERS", 2)
+    monkeypatch.setattr(core, "DOWNLOAD_WORKERS", 6)
+    files = make_files(40)
+    fake_google(files, fail_ids={"f7"}, delay=0.02)
+
+    job = run_job("ordered")
+
+    assert job["status"] == "COMPLETED"
+    zip_file = zipfile.ZipFile(job["artifact"]["path"])
+    assert zip_file.testzip() is None
+    # Largest first, whatever order the downloads and compressions finished in
+    expected = [f"Files/{f['name']}" for f in sorted(files, key=lambda f: int(f["size"]), reverse=True)]
+    expected = [name + ".error.txt" if name == "Files/file007.txt" else name for name in expected]
+    assert zip_file.namelist() == expected
+    for f in files:
+        if f["id"] != "f7":
+            assert zip_file.read(f"Files/{f['name']}") == file_content(f["id"], int(f["size"]))
+
+
+def test_job_parts_are_complete_archives(fake_google):
+    files = make_files(12)
+    fake_google(files)
+
+    job = run_job("parts", part_size=20000)
+
+    assert job["status"] == "COMPLETED"
+    assert len(job["parts"]) > 1
+    names = []
+    for part in job["parts"]:
+        assert part["status"] == "READY"
+        zip_file = zipfile.ZipFile(part["artifact"]["path"])
+        assert zip_file.testzip() is None
+        names += zip_file.namelist()
+    assert sorted(names) == sorted(f"Files/{f['name']}" for f in files)
+
+
+def test_failed_write_does_not_stall_the_members_behind_it(fake_google, monkeypatch):
+    # Few pending slots, so the members behind a stuck one would all wait in reserve()
+    monkeypatch.setattr(core, "COMPRESS_WORKERS", 1)
+    monkeypatch.setattr(core, "DOWNLOAD_WORKERS", 4)
+    files = make_files(20)
+    fake_google(files, fail_ids={"f3"}, delay=0.01)
+
+    def disk_full(self, name, data, *args, **kwargs):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(zipfile.ZipFile, "writestr", disk_full)
+
+    job = run_job_with_timeout("write-fails")
+
+    assert job["status"] == "COMPLETED"
+    zip_file = zipfile.ZipFile(job["artifact"]["path"])
+    assert sorted(zip_file.namelist()) == sorted(f"Files/{f['name']}" for f in files if f["id"] != "f3")
+
+
+def test_part_file_that_cannot_be_created_fails_the_job(fake_google, monkeypatch):
+    monkeypatch.setattr(core, "COMPRESS_WORKERS", 1)
+    monkeypatch.setattr(core, "DOWNLOAD_WORKERS", 4)
+    fake_google(make_files(20), delay=0.01)
+
+    def no_part_file(part):
+        raise OSError("Permission denied")
+    monkeypatch.setattr(core, "part_zip", no_part_file)
+
+    job = run_job_with_timeout("no-part-file")
+
+    assert job["status"] == "FAILED"
@@ -0,0 +1,185 @@
+import glob
+import os
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import core
+from backend.backends import ARTIFACT_DIR, PriorityGate
+from tests.fakes import make_files
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def start_waiter(gate, priority, order):
+    def run():
+        gate.acquire(priority)
+        order.append(priority)
+        gate.release()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_job_priority():
+    assert core.job_priority(["a"] * core.SMALL_JOB_FILES) == 0
+    assert core.job_priority(["a"] * (core.SMALL_JOB_FILES + 1), delta=True) == 1
+    assert core.job_priority(None, delta=True) == 1
+    assert core.job_priority(None) == 2
+
+
+def test_gate_hands_slots_to_most_urgent_waiter():
+    gate = PriorityGate(1)
+    gate.acquire(1)
+    order = []
+    threads = []
+    for priority in (2, 0, 1, 0):
+        threads.append(start_waiter(gate, priority, order))
+        wait_until(lambda: gate.waiting_count() == len(threads))
+
+    gate.release()
+    for thread in threads:
+        thread.join(5)
+    # Equal priorities keep their arrival order
+    assert order == [0, 0, 1, 2]
+    assert gate.waiting_count() == 0
+
+
+def test_yield_to_waiting_only_for_more_urgent_jobs():
+    gate = PriorityGate(1)
+    gate.acquire(1)
+    order = []
+    same = start_waiter(gate, 1, order)
+    wait_until(lambda: gate.waiting_count() == 1)
+    assert gate.yield_to_waiting(1) is False
+
+    urgent = start_waiter(gate, 0, order)
+    wait_until(lambda: gate.waiting_count() == 2)
+    # Gives the slot to the urgent job, then queues behind it and the earlier equal-priority waiter
+    assert gate.yield_to_waiting(1) is True
+    assert order == [0, 1]
+    gate.release()
+    for thread in (same, urgent):
+        thread.join(5)
+
+
+def test_checkpoint_pauses_job_while_urgent_job_runs():
+    gate = PriorityGate(1)
+    gate.acquire(2)
+    control = core.JobControl("preempted", 2, gate)
+    events = []
+    urgent_may_finish = threading.Event()
+
+    def urgent_job():
+        gate.acquire(0)
+        events.append("urgent started")
+        urgent_may_finish.wait(5)
+        events.append("urgent done")
+        gate.release()
+
+    thread = threading.Thread(target=urgent_job)
+    thread.start()
+    wait_until(lambda: gate.waiting_count() == 1)
+
+    def checkpoint():
+        control.checkpoint()
+        events.append("resumed")
+    resumer = threading.Thread(target=checkpoint)
+    resumer.start()
+    wait_until(lambda: "urgent started" in events)
+    assert "resumed" not in events
+    urgent_may_finish.set()
+    resumer.join(5)
+    thread.join(5)
+    assert events == ["urgent started", "urgent done", "resumed"]
+    gate.release()
+
+
+def test_check_cancelled(monkeypatch):
+    monkeypatch.setattr(core, "CANCEL_CHECK_INTERVAL", 0)
+    core.job_store.create("to-cancel", {"status": "PROCESSING"})
+    control = core.JobControl("to-cancel", 1)
+    control.check_cancelled()
+    core.job_store.request_cancel("to-cancel")
+    with pytest.raises(core.JobCancelled):
+        control.check_cancelled()
+
+
+def test_cancel_removes_finished_and_unfinished_parts(fake_google, monkeypatch):
+    monkeypatch.setattr(core, "CANCEL_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(core, "DOWNLOAD_WORKERS", 1)
+    job_id = "cancel-mid-job"
+    drive = fake_google(make_files(8))
+    downloads = []
+
+    def ready_parts():
+        return [part for part in core.job_store.get(job_id)["parts"] if part["status"] == "READY"]
+
+    def on_download(file_id):
+        downloads.append(file_id)
+        if len(downloads) == 5:
+            wait_until(lambda: len(ready_parts()) == 4)
+            core.job_store.request_cancel(job_id)
+    drive.on_download = on_download
+    deleted = []
+    delete = core.artifact_store.delete
+    monkeypatch.setattr(core.artifact_store, "delete", lambda ref: (deleted.append(ref), delete(ref)))
+
+    core.job_store.create(job_id, {"status": "QUEUED"})
+    # Parts smaller than any file: one part per file, four of them published before the cancel
+    core.background_zip_task(None, "course", job_id, "Course", part_size=1)
+
+    job = core.job_store.get(job_id)
+    assert job["status"] == "CANCELLED"
+    assert len(job["parts"]) == 8
+    assert all(part["status"] == "CANCELLED" and not part.get("artifact") for part in job["parts"])
+    # Parts published before the cancel went through the artifact store
+    assert deleted
+    assert glob.glob(os.path.join(ARTIFACT_DIR, f"gcr_{job_id}*")) == []
+
+
+def test_job_cancelled_while_queued_never_runs(fake_google, monkeypatch):
+    ran = []
+    monkeypatch.setattr(core, "background_zip_task", lambda *args: ran.append(args))
+    core.job_store.create("queued", {"status": "QUEUED"})
+    # Reported cancelled at once, without waiting for a slot
+    assert core.cancel_job("queued") == "CANCELLED"
+    assert core.job_store.get("queued")["status"] == "CANCELLED"
+
+    core.run_job({"job_id": "queued", "course_id": "c", "course_name": "C", "live_credentials": object()})
+
+    assert ran == []
+    assert core.job_store.get("queued")["status"] == "CANCELLED"
+    assert core.cancel_job("queued") is None
+
+
+def test_cancel_stops_the_course_scan(fake_google, monkeypatch):
+    monkeypatch.setattr(core, "CANCEL_CHECK_INTERVAL", 0)
+    drive = fake_google(make_files(8))
+    pages = []
+    list_page = drive.list
+    monkeypatch.setattr(drive, "list", lambda q, **kw: pages.append(q) or list_page(q, **kw))
+    core.job_store.create("scan", {"status": "PROCESSING"})
+    core.job_store.request_cancel("scan")
+
+    core.background_zip_task(None, "course", "scan", "Course")
+
+    assert core.job_store.get("scan")["status"] == "CANCELLED"
+    # Stopped at the first post, before listing the folder attached to it
+    assert pages == []
+
+
+def test_parts_of_cancelled_job_are_not_served():
+    from backend.main import app
+    core.job_store.create("gone", {"status": "CANCELLED", "parts": [
+        {"number": 1, "filename": "C.part001.zip", "status": "READY", "artifact": {"kind": "local", "path": "/nope"}}
+    ]})
+    response = TestClient(app).get("/download/result/gone/parts/1")
+    assert response.status_code == 400